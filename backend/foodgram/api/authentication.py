@@ -0,0 +1,146 @@
+import copy
+import time
+from collections import OrderedDict
+from threading import Lock
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+INVALID = object()
+DEFAULTS = {
+    'TTL': 30,
+    'MAX_SIZE': 10000,
+    'CACHE_ALIAS': None,
+}
+
+
+class TokenCache:
+    """LRU-кэш token -> user с ограниченным временем жизни записи.
+
+    Если задан CACHE_ALIAS, token -> user.pk дополнительно хранится
+    в общем кэше Django. Там же лежит ревизия токена, которую меняет
+    invalidate(): локальная запись действительна, только пока ревизия
+    совпадает с прочитанной при загрузке, поэтому отозванный токен
+    перестает приниматься сразу во всех процессах.
+    """
+
+    def __init__(self, ttl, max_size, cache_alias=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def shared(self):
+        if self.cache_alias is None:
+            return None
+        return caches[self.cache_alias]
+
+    def shared_key(self, key):
+        return f'auth-token:{key}'
+
+    def revision_key(self, key):
+        return f'auth-token-revision:{key}'
+
+    def revision(self, key):
+        if self.shared is None:
+            return None
+        return self.shared.get(self.revision_key(key))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires, revision = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        if self.shared is not None and self.revision(key) != revision:
+            return None
+        return value
+
+    def set(self, key, value, revision=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl,
+                                  revision)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete_many([self.shared_key(key) for key in keys])
+            # локальные записи живут не дольше ttl, дольше ревизия
+            # не нужна
+            self.shared.set_many(
+                {self.revision_key(key): uuid4().hex for key in keys},
+                self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+config = {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+token_cache = TokenCache(config['TTL'], config['MAX_SIZE'],
+                         config['CACHE_ALIAS'])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с кэшированием результата проверки токена.
+
+    Неизвестные токены тоже кэшируются, чтобы устаревшие токены
+    анонимного трафика не доходили до базы на каждом запросе.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            revision = token_cache.revision(key)
+            user = self.load_user(key)
+            token_cache.set(key, user, revision)
+        if user is INVALID:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        return copy.copy(user), key
+
+    def load_user(self, key):
+        shared = token_cache.shared
+        if shared is not None:
+            user_id = shared.get(token_cache.shared_key(key))
+            if user_id is not None:
+                return self.load_shared_user(key, user_id)
+        try:
+            user, _token = super().authenticate_credentials(key)
+        except exceptions.AuthenticationFailed:
+            user = INVALID
+        if shared is not None:
+            shared.set(token_cache.shared_key(key),
+                       0 if user is INVALID else user.pk,
+                       token_cache.ttl)
+        return user
+
+    def load_shared_user(self, key, user_id):
+        if not user_id:
+            return INVALID
+        user = User.objects.filter(pk=user_id, is_active=True).first()
+        return user or INVALID
+
+
+def invalidate_user_tokens(user_id):
+    keys = list(Token.objects.filter(user_id=user_id)
+                .values_list('key', flat=True))
+    if keys:
+        token_cache.invalidate(*keys)
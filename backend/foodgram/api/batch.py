@@ -0,0 +1,79 @@
+"""Пакетное добавление и удаление связей пользователя.
+
+Используется для избранного, корзины и подписок: клиент присылает
+списки id для добавления и удаления, в ответ получает статус по
+каждому id.
+"""
+from django.db.models import F
+
+from users.models import User
+
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+MISSING = 'missing'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+
+
+def lock_users(user_ids):
+    """Блокирует строки пользователей до конца транзакции.
+
+    Одиночные и пакетные изменения связей пользователя берут эту
+    блокировку первой, поэтому выполняются по очереди и не считают
+    одну и ту же вставку дважды. Строки блокируются по возрастанию pk,
+    чтобы встречные подписки не приводили к взаимной блокировке.
+    """
+    User.objects.filter(pk__in=user_ids).lock()
+
+
+def shift_counter(queryset, counter, added, removed):
+    """Увеличивает счетчик объектов added и уменьшает у removed на 1."""
+    for ids, delta in ((added, 1), (removed, -1)):
+        if ids:
+            queryset.filter(pk__in=ids).update(
+                **{counter: F(counter) + delta})
+
+
+def change_relations(model, user, field, add, remove, targets,
+                     forbidden=()):
+    """Применяет изменения, возвращает (результаты, added, removed).
+
+    targets - queryset объектов, на которые можно ссылаться, forbidden -
+    id, которые добавлять нельзя. Вставка идет одним bulk_create с
+    ignore_conflicts, удаление - одним delete(). Функция должна
+    вызываться внутри транзакции после lock_users.
+    """
+    column = f'{field}_id'
+    requested = set(add) | set(remove)
+    found = set(targets.filter(pk__in=requested)
+                .values_list('pk', flat=True))
+    existing = set(
+        model.objects.filter(user=user, **{f'{column}__in': found})
+        .values_list(column, flat=True))
+    added = {pk for pk in add
+             if pk in found and pk not in existing and pk not in forbidden}
+    removed = {pk for pk in remove if pk in existing}
+    model.objects.bulk_create(
+        [model(user=user, **{column: pk}) for pk in added],
+        ignore_conflicts=True)
+    if removed:
+        model.objects.filter(user=user,
+                             **{f'{column}__in': removed}).delete()
+
+    def status_of(pk, adding):
+        if pk not in found:
+            return NOT_FOUND
+        if adding:
+            if pk in forbidden:
+                return FORBIDDEN
+            return ADDED if pk in added else EXISTS
+        return REMOVED if pk in removed else MISSING
+
+    results = (
+        [{'id': pk, 'action': 'add', 'status': status_of(pk, True)}
+         for pk in dict.fromkeys(add)]
+        + [{'id': pk, 'action': 'remove', 'status': status_of(pk, False)}
+           for pk in dict.fromkeys(remove)]
+    )
+    return results, added, removed
@@ -0,0 +1,24 @@
+import hashlib
+import json
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    payload = json.dumps(parts, default=str, sort_keys=True)
+    return quote_etag(hashlib.md5(payload.encode()).hexdigest())
+
+
+def not_modified(request, etag, last_modified=None):
+    """HttpResponseNotModified, если клиентская копия актуальна."""
+    return get_conditional_response(
+        request, etag=etag,
+        last_modified=last_modified and int(last_modified.timestamp()))
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
@@ -0,0 +1,93 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from django.db.models import F, Sum
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer, ABC):
+    """Рендерер для согласования формата и вывода ошибок выгрузки."""
+    charset = 'utf-8'
+    extension = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    @abstractmethod
+    def rows(self, items):
+        """Строки выгрузки по сгруппированным позициям списка покупок."""
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    extension = 'csv'
+
+    def rows(self, items):
+        writer = csv.writer(Echo())
+        yield writer.writerow(['Ingredient', 'Measurement unit', 'Amount'])
+        for item in items:
+            yield writer.writerow([item['name'], item['measurement_unit'],
+                                   item['amount']])
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    extension = 'txt'
+
+    def rows(self, items):
+        for item in items:
+            yield (f"{item['name']} ({item['measurement_unit']}) — "
+                   f"{item['amount']}\n")
+
+
+class JSONLinesShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+    extension = 'jsonl'
+
+    def rows(self, items):
+        for item in items:
+            yield json.dumps(item, ensure_ascii=False) + '\n'
+
+
+SHOPPING_LIST_RENDERERS = (
+    CSVShoppingListRenderer,
+    TextShoppingListRenderer,
+    JSONLinesShoppingListRenderer,
+)
+
+
+def shopping_list_items(user):
+    """Список покупок, сгруппированный по (ингредиент, единица)."""
+    return (
+        user.shopping_list
+        .values(name=F('ingredient__name'),
+                measurement_unit=F('ingredient__measurement_unit'))
+        .annotate(amount=Sum('amount'))
+        .order_by('name', 'measurement_unit')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def stream_shopping_list(user, renderer):
+    response = StreamingHttpResponse(
+        renderer.rows(shopping_list_items(user)),
+        content_type=f'{renderer.media_type}; charset={renderer.charset}')
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping_cart.{renderer.extension}"')
+    return response
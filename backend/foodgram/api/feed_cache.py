@@ -0,0 +1,184 @@
+import hashlib
+import json
+import time
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+
+from recipes.catalog import (bump_version, ingredient_catalog, read_versions,
+                             tag_catalog)
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscribe
+
+DEFAULTS = {
+    'TTL': 60,
+    'CACHE_ALIAS': 'default',
+}
+# фильтры, результат которых зависит от пользователя: такие страницы
+# не кэшируются
+PERSONAL_PARAMS = ('is_favorited', 'is_in_shopping_cart')
+# в результаты поиска рецепт попадает по тексту, а не по автору и тэгам,
+# его изменения не отражаются в версиях областей
+UNCACHED_PARAMS = PERSONAL_PARAMS + ('search',)
+
+
+class FeedPage:
+    """Страница списка с версиями, снятыми до ее сборки."""
+
+    def __init__(self, feed_cache, key, versions):
+        self.feed_cache = feed_cache
+        self.key = key
+        self.versions = versions
+
+    def get(self):
+        """Данные страницы, если ни версии, ни ее рецепты не менялись."""
+        entry = self.feed_cache.cache.get(self.key)
+        if entry is None or entry['versions'] != self.versions:
+            return None
+        stamps = entry['stamps']
+        if stamps and dict(
+            Recipe.objects.filter(pk__in=stamps)
+            .values_list('pk', 'updated_at')
+        ) != stamps:
+            return None
+        return entry['data']
+
+    def set(self, data, recipes):
+        self.feed_cache.cache.set(self.key, {
+            'data': data,
+            'versions': self.versions,
+            'stamps': {recipe.pk: recipe.updated_at for recipe in recipes},
+        }, self.feed_cache.ttl)
+
+
+class FeedCache:
+    """Кэш страниц списка рецептов в анонимном виде.
+
+    Страница хранится без пользовательских флагов, при выдаче на нее
+    накладываются is_favorited, is_in_shopping_cart и
+    author.is_subscribed текущего пользователя. Страницы лежат в кэше
+    cache_alias, по умолчанию в памяти процесса, а все, по чему
+    проверяется их актуальность, - в общей БД:
+
+    - updated_at рецептов страницы сверяются при выдаче одним запросом
+      по первичному ключу. Правка рецепта, в том числе запись вариантов
+      картинки, сбрасывает только страницы с этим рецептом;
+    - состав страниц меняют создание и удаление рецепта и смена его
+      тэгов. Для этого в CatalogVersion хранятся версии областей: всей
+      ленты, ленты автора и страниц с фильтром по тэгам. Страница
+      зависит только от своих областей;
+    - переименование тэга или ингредиента меняет версию справочника.
+
+    Версии областей сверяются с БД не чаще раза в check_interval
+    секунд. Счетчики избранного и подписчиков и данные автора могут
+    отставать не более чем на ttl.
+    """
+    version_name = 'recipe-feed'
+    check_interval = 1
+
+    def __init__(self, ttl, cache_alias):
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._lock = Lock()
+        self._checked = {}
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def author_scope(self, author_id):
+        return f'{self.version_name}:author:{author_id}'
+
+    @property
+    def tags_scope(self):
+        return f'{self.version_name}:tags'
+
+    def scopes(self, request):
+        """Области, от которых зависит состав страницы."""
+        params = request.query_params
+        author = params.get('author', '')
+        if author.isdigit():
+            names = [self.author_scope(int(author))]
+        else:
+            names = [self.version_name]
+        if params.getlist('tags'):
+            names.append(self.tags_scope)
+        return names
+
+    def scope_versions(self, names):
+        now = time.monotonic()
+        versions = {}
+        with self._lock:
+            for name in names:
+                version, checked = self._checked.get(name, (None, None))
+                if checked is not None and now < checked + self.check_interval:
+                    versions[name] = version
+        missing = [name for name in names if name not in versions]
+        if missing:
+            for name, (version, _) in read_versions(missing).items():
+                versions[name] = version
+                with self._lock:
+                    self._checked[name] = (version, now)
+        return tuple(versions[name] for name in names)
+
+    def page(self, request):
+        """Страница кэша или None, если страница не кэшируется."""
+        params = request.query_params
+        if any(param in params for param in UNCACHED_PARAMS):
+            return None
+        payload = json.dumps([
+            request.scheme, request.get_host(), request.path,
+            sorted((key, params.getlist(key)) for key in params),
+        ])
+        digest = hashlib.md5(payload.encode()).hexdigest()
+        versions = (
+            self.scope_versions(self.scopes(request)),
+            tag_catalog.version()[0],
+            ingredient_catalog.version()[0],
+        )
+        return FeedPage(self, f'recipe-feed:{digest}', versions)
+
+    def _bump(self, names):
+        for name in names:
+            bump_version(name)
+        with self._lock:
+            for name in names:
+                self._checked.pop(name, None)
+
+    def invalidate_author(self, author_id):
+        """Рецепт автора создан или удален."""
+        self._bump([self.version_name, self.author_scope(author_id)])
+
+    def invalidate_tags(self):
+        """У рецептов изменились тэги."""
+        self._bump([self.tags_scope])
+
+    def personalize(self, data, user):
+        """Накладывает флаги пользователя на анонимную страницу."""
+        if not user.is_authenticated:
+            return data
+        results = data['results'] if isinstance(data, dict) else data
+        recipe_ids = [recipe['id'] for recipe in results]
+        author_ids = {recipe['author']['id'] for recipe in results}
+        if not recipe_ids:
+            return data
+        favorited = set(
+            Favorite.objects.filter(user=user, recipe_id__in=recipe_ids)
+            .values_list('recipe_id', flat=True))
+        in_cart = set(
+            ShoppingCart.objects.filter(user=user, recipe_id__in=recipe_ids)
+            .values_list('recipe_id', flat=True))
+        followed = set(
+            Subscribe.objects.filter(user=user, author_id__in=author_ids)
+            .values_list('author_id', flat=True))
+        for recipe in results:
+            recipe['is_favorited'] = recipe['id'] in favorited
+            recipe['is_in_shopping_cart'] = recipe['id'] in in_cart
+            recipe['author']['is_subscribed'] = (
+                recipe['author']['id'] in followed)
+        return data
+
+
+config = {**DEFAULTS, **getattr(settings, 'RECIPE_FEED_CACHE', {})}
+feed_cache = FeedCache(config['TTL'], config['CACHE_ALIAS'])
@@ -1,21 +1,44 @@
 
+from django.db.models import (Case, Exists, F, IntegerField, OuterRef, Value,
+                              When)
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Recipe, Tag
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+from recipes import search
+from recipes.catalog import tag_catalog
+from recipes.models import Recipe
+
+
+def tag_slug_choices():
+    return [(tag.slug, tag.slug) for tag in tag_catalog.all()]
 
 
 class RecipeFilter(FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(field_name='tags__slug',
-                                             to_field_name='slug',
-                                             queryset=Tag.objects.all())
+    tags = filters.MultipleChoiceFilter(choices=tag_slug_choices,
+                                        method='tags_filter')
     is_favorited = filters.BooleanFilter(
         method='is_favorited_filter')
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_filter')
+    search = filters.CharFilter(method='search_filter')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'popular'), ('trending', 'trending')),
+        method='ordering_filter')
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author',)
 
+    def tags_filter(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тэгов, через EXISTS без JOIN."""
+        if not value:
+            return queryset
+        slugs = set(value)
+        tag_ids = [tag.id for tag in tag_catalog.all() if tag.slug in slugs]
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(recipe_id=OuterRef('pk'),
+                                               tag_id__in=tag_ids)))
+
     def is_favorited_filter(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
@@ -27,3 +50,61 @@ class RecipeFilter(FilterSet):
         if value and user.is_authenticated:
             return queryset.filter(shopping_recipe__user=user)
         return queryset
+
+    def search_filter(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return search.search(queryset, value)
+
+    def ordering_filter(self, queryset, name, value):
+        """Сортировка по RecipeScore через INNER JOIN.
+
+        Строка рейтинга создается вместе с рецептом, поэтому join
+        никого не отбрасывает. Оба ключа, рейтинг и recipe_id, берутся
+        из RecipeScore: тогда сортировка целиком идет по индексу
+        (рейтинг, recipe) и страница читает только свои строки.
+        """
+        return queryset.filter(score__isnull=False).annotate(
+            feed_score=F(f'score__{value}'), feed_id=F('score__recipe_id')
+        ).order_by('-feed_score', '-feed_id')
+
+
+class IngredientSearchFilter(BaseFilterBackend):
+    """Автодополнение ингредиентов по индексам на name.
+
+    Сначала берутся совпадения по началу названия, затем, если лимит
+    не набран, совпадения по подстроке. Оба запроса ограничены
+    max_results и обслуживаются индексами из миграции recipes.
+    """
+    search_param = api_settings.SEARCH_PARAM
+    max_results = 20
+    min_contains_length = 3
+
+    def get_search_term(self, request):
+        return request.query_params.get(self.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        term = self.get_search_term(request)
+        if not term:
+            return queryset
+        ids = list(
+            queryset.filter(name__istartswith=term)
+            .order_by('name')
+            .values_list('id', flat=True)[:self.max_results]
+        )
+        if (len(ids) < self.max_results
+                and len(term) >= self.min_contains_length):
+            ids += list(
+                queryset.filter(name__icontains=term)
+                .exclude(name__istartswith=term)
+                .order_by('name')
+                .values_list('id', flat=True)[:self.max_results - len(ids)]
+            )
+        return queryset.filter(id__in=ids).annotate(
+            search_rank=Case(
+                When(name__istartswith=term, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('search_rank', 'name')
@@ -0,0 +1,54 @@
+"""Общие части команд benchmark_*.
+
+Замеры выполняются только на временной тестовой БД: она создается так
+же, как в manage.py test, и удаляется после замеров. Данные для
+замеров к тому же создаются в транзакции, которая откатывается.
+Рабочая база команды не затрагивают.
+"""
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+
+
+@contextmanager
+def benchmark_database():
+    """Временная тестовая БД и откатываемая транзакция в ней."""
+    old_name = connection.settings_dict['NAME']
+    test_name = connection.creation.create_test_db(verbosity=0,
+                                                   serialize=False)
+    try:
+        if test_name == old_name:
+            raise CommandError('Замеры запускаются только на тестовой БД')
+        with transaction.atomic():
+            yield
+            transaction.set_rollback(True)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def timed(func, repeat=1):
+    """Лучшее время выполнения func из repeat запусков, в секундах."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(func):
+    """Пиковый объем памяти Python-объектов во время func, в байтах."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def kib(size):
+    return f'{size / 1024:.0f} КиБ'
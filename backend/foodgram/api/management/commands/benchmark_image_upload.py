@@ -0,0 +1,118 @@
+import base64
+import json
+import os
+import tempfile
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.management.benchmark import (benchmark_database, kib,
+                                      peak_memory, timed)
+from api.views import RecipeViewSet
+from recipes.models import Ingredient, Tag
+from users.models import User
+
+
+def noise_png(size):
+    """PNG из случайных пикселей: почти не сжимается, весит около size."""
+    side = int((size / 3) ** 0.5)
+    image = Image.frombytes('RGB', (side, side), os.urandom(side * side * 3))
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def upload_view():
+    # роутер передает в as_view параметры @action, в том числе парсеры
+    return RecipeViewSet.as_view({'post': 'upload_image'},
+                                 **RecipeViewSet.upload_image.kwargs)
+
+
+class Command(BaseCommand):
+    help = ("Замер пиковой памяти загрузки картинки: base64 в JSON "
+            "при создании рецепта против multipart и двоичного тела "
+            "в /api/recipes/images/")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size-mb', type=float, default=5,
+            help='Размер картинки в мегабайтах')
+
+    def handle(self, *args, **options):
+        content = noise_png(int(options['size_mb'] * 1024 * 1024))
+        self.stdout.write(f'Картинка: {kib(len(content))}')
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root), \
+                benchmark_database():
+            self.user = User.objects.create(
+                username='benchmark', email='benchmark@example.com',
+                first_name='benchmark', last_name='benchmark')
+            requests = {
+                'base64 JSON': self.base64_request(content),
+                'multipart': self.multipart_request(content),
+                'двоичное тело': self.raw_request(content),
+            }
+            for name, (view, build) in requests.items():
+                self.measure(name, view, build)
+
+    def measure(self, name, view, build):
+        # запрос собирается до замера: тело уже в памяти у WSGI-сервера
+        # и не должно попадать в пик обработки
+        request = build()
+        response = None
+
+        def handle():
+            nonlocal response
+            response = view(request)
+            response.render()
+
+        memory = peak_memory(handle)
+        if response.status_code != 201:
+            self.stderr.write(f'{name}: {response.status_code} '
+                              f'{response.content[:200]!r}')
+            return
+        elapsed = timed(lambda: view(build()).render())
+        self.stdout.write(f'{name:>14}: память {kib(memory):>10}, '
+                          f'{elapsed * 1000:8.1f} мс')
+
+    def authenticated(self, request):
+        force_authenticate(request, self.user)
+        return request
+
+    def base64_request(self, content):
+        tag = Tag.objects.create(name='benchmark', color='#000000',
+                                 slug='benchmark')
+        ingredient = Ingredient.objects.create(name='benchmark',
+                                               measurement_unit='г')
+        body = json.dumps({
+            'name': 'benchmark',
+            'text': 'benchmark',
+            'cooking_time': 1,
+            'tags': [tag.pk],
+            'ingredients': [{'id': ingredient.pk, 'amount': 1}],
+            'image': 'data:image/png;base64,'
+                     + base64.b64encode(content).decode(),
+        })
+        view = RecipeViewSet.as_view({'post': 'create'})
+        return view, lambda: self.authenticated(APIRequestFactory().post(
+            '/api/recipes/', body, content_type='application/json'))
+
+    def multipart_request(self, content):
+        view = upload_view()
+
+        def build():
+            image = BytesIO(content)
+            image.name = 'benchmark.png'
+            return self.authenticated(APIRequestFactory().post(
+                '/api/recipes/images/', {'image': image},
+                format='multipart'))
+        return view, build
+
+    def raw_request(self, content):
+        view = upload_view()
+        return view, lambda: self.authenticated(APIRequestFactory().post(
+            '/api/recipes/images/', content, content_type='image/png',
+            HTTP_CONTENT_DISPOSITION='attachment; filename=benchmark.png'))
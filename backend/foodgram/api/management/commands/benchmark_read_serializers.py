@@ -0,0 +1,125 @@
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.management.benchmark import benchmark_database, timed
+from api.serializers import (RecipeIngredientReadSerializer,
+                             RecipeReadSerializer, TagsReadSerializer,
+                             UserReadSerializer)
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from users.models import User
+
+TAGS_PER_RECIPE = 3
+INGREDIENTS_PER_RECIPE = 8
+AUTHORS = 50
+
+
+class GenericUserSerializer(UserReadSerializer):
+    to_representation = serializers.ModelSerializer.to_representation
+
+
+class GenericTagSerializer(TagsReadSerializer):
+    to_representation = serializers.ModelSerializer.to_representation
+
+
+class GenericRecipeIngredientSerializer(RecipeIngredientReadSerializer):
+    to_representation = serializers.ModelSerializer.to_representation
+
+
+class GenericRecipeSerializer(RecipeReadSerializer):
+    """Тот же ответ, собранный полями DRF, как до сборки словарей."""
+    author = GenericUserSerializer(read_only=True)
+    tags = GenericTagSerializer(many=True, read_only=True)
+    ingredients = GenericRecipeIngredientSerializer(
+        many=True, read_only=True, source='recipes')
+
+    to_representation = serializers.ModelSerializer.to_representation
+
+
+class Command(BaseCommand):
+    help = ("Замер сериализации ленты рецептов: сборка словарей "
+            "в RecipeReadSerializer против обычного "
+            "ModelSerializer.to_representation")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=1000,
+            help='Число рецептов в ленте')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Сколько раз повторить замер')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            reader = self.create_recipes(options['recipes'])
+            request = Request(APIRequestFactory().get('/api/recipes/'))
+            request.user = reader
+            context = {'request': request,
+                       'view': SimpleNamespace(action='list')}
+            recipes = list(Recipe.objects.for_feed(reader))
+            self.measure(recipes, context, options['repeat'])
+
+    def measure(self, recipes, context, repeat):
+        def serialize(serializer_class):
+            return serializer_class(recipes, many=True, context=context).data
+
+        if serialize(RecipeReadSerializer) != serialize(
+                GenericRecipeSerializer):
+            self.stderr.write('Ответы сериализаторов различаются')
+            return
+        per_thousand = 1000 / len(recipes)
+        results = {
+            'словари': timed(lambda: serialize(RecipeReadSerializer),
+                             repeat),
+            'ModelSerializer': timed(
+                lambda: serialize(GenericRecipeSerializer), repeat),
+        }
+        for name, elapsed in results.items():
+            milliseconds = elapsed * per_thousand * 1000
+            self.stdout.write(
+                f'{name:>15}: {milliseconds:8.1f} мс на 1000 рецептов')
+        self.stdout.write('Ускорение: {:.1f}x'.format(
+            results['ModelSerializer'] / results['словари']))
+
+    def create_recipes(self, count):
+        reader = User.objects.create(
+            username='benchmark', email='benchmark@example.com',
+            first_name='benchmark', last_name='benchmark')
+        authors = [
+            User.objects.create(
+                username=f'benchmark-{number}',
+                email=f'benchmark-{number}@example.com',
+                first_name='benchmark', last_name='benchmark')
+            for number in range(AUTHORS)
+        ]
+        tags = [Tag.objects.create(name=f'benchmark-{number}',
+                                   color=f'#00000{number}',
+                                   slug=f'benchmark-{number}')
+                for number in range(TAGS_PER_RECIPE)]
+        ingredients = [
+            Ingredient.objects.create(name=f'benchmark-{number}',
+                                      measurement_unit='г')
+            for number in range(INGREDIENTS_PER_RECIPE)
+        ]
+        Recipe.objects.bulk_create(
+            Recipe(name=f'benchmark-{number}', text='benchmark',
+                   cooking_time=10, author=authors[number % AUTHORS],
+                   image='images/benchmark.png')
+            for number in range(count)
+        )
+        recipes = Recipe.objects.filter(author__in=authors)
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.pk)
+            for recipe_id in recipes.values_list('pk', flat=True)
+            for tag in tags
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe_id=recipe_id, ingredient=ingredient,
+                             amount=10)
+            for recipe_id in recipes.values_list('pk', flat=True)
+            for ingredient in ingredients
+        )
+        return reader
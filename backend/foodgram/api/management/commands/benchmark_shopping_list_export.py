@@ -0,0 +1,79 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from api.exporters import SHOPPING_LIST_RENDERERS, stream_shopping_list
+from api.management.benchmark import (benchmark_database, kib,
+                                      peak_memory, timed)
+from recipes.models import Ingredient, ShoppingListItem
+from users.models import User
+
+BATCH_SIZE = 5000
+UNITS = ('г', 'кг', 'шт')
+
+
+class Command(BaseCommand):
+    help = ("Замер выгрузки списка покупок для корзин разного размера: "
+            "время и пиковая память потоковой выгрузки и той же выгрузки, "
+            "собранной целиком в памяти")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 1000, 50000],
+            help='Число строк списка покупок в каждом замере')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Сколько раз повторить замер времени')
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        with benchmark_database():
+            ingredient_ids = self.create_ingredients(sizes[-1])
+            for size in sizes:
+                user = self.create_list(size, ingredient_ids[:size])
+                for renderer_class in SHOPPING_LIST_RENDERERS:
+                    self.measure(user, renderer_class(), size,
+                                 options['repeat'])
+
+    def create_ingredients(self, count):
+        names = (f'benchmark-{number}' for number in range(count))
+        while True:
+            batch = list(islice(names, BATCH_SIZE))
+            if not batch:
+                break
+            Ingredient.objects.bulk_create(
+                Ingredient(name=name, measurement_unit=UNITS[number % 3])
+                for number, name in enumerate(batch))
+        return list(Ingredient.objects.filter(name__startswith='benchmark-')
+                    .order_by('pk').values_list('pk', flat=True))
+
+    def create_list(self, size, ingredient_ids):
+        user = User.objects.create(
+            username=f'benchmark-{size}',
+            email=f'benchmark-{size}@example.com',
+            first_name='benchmark', last_name='benchmark')
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user=user, ingredient_id=ingredient_id,
+                              amount=number % 500 + 1)
+             for number, ingredient_id in enumerate(ingredient_ids)),
+            batch_size=BATCH_SIZE)
+        return user
+
+    def measure(self, user, renderer, size, repeat):
+        def stream():
+            total = 0
+            response = stream_shopping_list(user, renderer)
+            for chunk in response.streaming_content:
+                total += len(chunk)
+            return total
+
+        def buffered():
+            response = stream_shopping_list(user, renderer)
+            return b''.join(response.streaming_content)
+
+        elapsed = timed(stream, repeat)
+        self.stdout.write(
+            f'{size:>6} строк, {renderer.format:>5}: '
+            f'{elapsed * 1000:8.1f} мс, {stream() / 1024:8.0f} КиБ, '
+            f'память: поток {kib(peak_memory(stream)):>10}, '
+            f'целиком {kib(peak_memory(buffered)):>10}')
@@ -1,5 +1,161 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (CursorPagination, PageNumberPagination,
+                                       _positive_int, _reverse_ordering)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+PAGINATION_MODE_PARAM = 'pagination'
+CURSOR_MODE = 'cursor'
 
 
 class CustomPaginator(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPaginator(CursorPagination):
+    """Keyset-пагинация по (ключ, id) без COUNT(*) и OFFSET.
+
+    CursorPagination из DRF ищет позицию только по первому полю
+    сортировки, а рецепты с равным ключом (одинаковый рейтинг, ранг
+    поиска) пропускает смещением. Здесь позиция - пара "ключ|id",
+    и страница выбирается условием по обоим полям.
+    """
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        if 'feed_score' in queryset.query.annotations:
+            return ('-feed_score', '-feed_id')
+        if 'search_rank' in queryset.query.annotations:
+            return ('-search_rank', '-id')
+        return super().get_ordering(request, queryset, view)
+
+    def seek(self, position, reverse):
+        """Условие "строго после позиции" в порядке выдачи страницы."""
+        try:
+            value, pk = position.rsplit('|', 1)
+            pk = int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        key, id_key = (order.lstrip('-') for order in self.ordering)
+        # поля сортируются по убыванию, обратный курсор идет вверх
+        lookup = 'gt' if reverse else 'lt'
+        return (Q(**{f'{key}__{lookup}': value})
+                | Q(**{key: value, f'{id_key}__{lookup}': pk}))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if len(self.get_ordering(request, queryset, view)) != 2:
+            return super().paginate_queryset(queryset, request, view)
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self.seek(current_position, reverse))
+        # позиции уникальны, offset остается нулевым у своих курсоров
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering)
+        has_current = current_position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = (
+                has_current, following_position is not None)
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next, self.has_previous = (
+                following_position is not None, has_current)
+            self.next_position = following_position
+            self.previous_position = current_position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _get_position_from_instance(self, instance, ordering):
+        if len(ordering) != 2:
+            return super()._get_position_from_instance(instance, ordering)
+        key, id_key = (order.lstrip('-') for order in ordering)
+        return '{}|{}'.format(getattr(instance, key),
+                              getattr(instance, id_key))
+
+
+class SubscriptionCursorPaginator(RecipeCursorPaginator):
+    ordering = ('-subscription_id',)
+
+
+class CursorPaginationMixin:
+    """Включает cursor-пагинацию по ?pagination=cursor или ?cursor=."""
+    cursor_pagination_class = None
+
+    def use_cursor_pagination(self):
+        params = self.request.query_params
+        return (self.cursor_pagination_class is not None
+                and (params.get(PAGINATION_MODE_PARAM) == CURSOR_MODE
+                     or RecipeCursorPaginator.cursor_query_param in params))
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.use_cursor_pagination():
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
+
+
+class TimelinePaginator:
+    """Keyset-пагинация ленты по позиции (pub_date, id).
+
+    Страница собирается из нескольких источников, поэтому курсор
+    хранит саму позицию последнего рецепта, а не смещение.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_position(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            pub_date, pk = b64decode(
+                encoded.encode('ascii')).decode('ascii').split('|')
+            return datetime.fromisoformat(pub_date), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self, request, position):
+        pub_date, pk = position
+        encoded = b64encode(
+            f'{pub_date.isoformat()}|{pk}'.encode('ascii')).decode('ascii')
+        return replace_query_param(request.build_absolute_uri(),
+                                   self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, request, data, page, page_size):
+        next_link = None
+        if len(page) == page_size:
+            next_link = self.get_next_link(request, page[-1])
+        return Response({'next': next_link, 'results': data})
@@ -1,3 +1,5 @@
+from collections import Counter
+
 from rest_framework import serializers
 from users.models import User, Subscribe
 from djoser.serializers import UserSerializer, UserCreateSerializer
@@ -5,9 +7,46 @@ from django.contrib.auth.hashers import check_password
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from recipes.models import (Favorite, ShoppingCart, Tag, Ingredient,
-                            RecipeIngredient, Recipe)
+                            RecipeIngredient, Recipe, UploadedImage)
+from recipes import images, shopping_list
+from recipes.catalog import ingredient_catalog, tag_catalog
 from drf_base64.fields import Base64ImageField
 from django.db import transaction
+from django.db.models import F
+
+BATCH_MAX_SIZE = 500
+
+
+def user_representation(user, is_subscribed):
+    return {
+        'email': user.email,
+        'id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'is_subscribed': is_subscribed,
+        'recipes_count': user.recipes_count,
+        'followers_count': user.followers_count,
+    }
+
+
+def tag_representation(tag):
+    return {
+        'id': tag.id,
+        'name': tag.name,
+        'color': tag.color,
+        'slug': tag.slug,
+    }
+
+
+def recipe_ingredient_representation(recipe_ingredient):
+    ingredient = recipe_ingredient.ingredient
+    return {
+        'id': ingredient.id,
+        'name': ingredient.name,
+        'measurement_unit': ingredient.measurement_unit,
+        'amount': recipe_ingredient.amount,
+    }
 
 
 class UserReadSerializer(UserSerializer):
@@ -17,15 +56,22 @@ class UserReadSerializer(UserSerializer):
         model = User
         fields = ('email', 'id', 'username',
                   'first_name', 'last_name',
-                  'is_subscribed')
+                  'is_subscribed', 'recipes_count', 'followers_count')
+        read_only_fields = ('recipes_count', 'followers_count')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         if (self.context.get('request')
            and not self.context['request'].user.is_anonymous):
             return Subscribe.objects.filter(user=self.context['request'].user,
                                             author=obj).exists()
         return False
 
+    def to_representation(self, instance):
+        return user_representation(instance,
+                                   self.get_is_subscribed(instance))
+
 
 class UserCreateSerializer(UserCreateSerializer):
     class Meta:
@@ -75,6 +121,9 @@ class TagsReadSerializer(serializers.ModelSerializer):
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
 
+    def to_representation(self, instance):
+        return tag_representation(instance)
+
 
 class IngredientsReadSerializer(serializers.ModelSerializer):
 
@@ -83,6 +132,31 @@ class IngredientsReadSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
+class RecipeImageField(serializers.ReadOnlyField):
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def get_variant(self):
+        return self.variant
+
+    def to_representation(self, recipe):
+        return images.image_url(recipe, self.get_variant(),
+                                self.context.get('request'))
+
+
+class FeedImageField(RecipeImageField):
+    """Карточка в списке рецептов, webp исходного размера в детальном."""
+
+    def get_variant(self):
+        view = self.context.get('view')
+        if view is not None and view.action in ('list', 'feed', 'match'):
+            return 'card'
+        return 'webp'
+
+
 class RecipeIngredientReadSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='ingredient.id')
     name = serializers.ReadOnlyField(source='ingredient.name')
@@ -94,6 +168,9 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):
         fields = ('id', 'name',
                   'measurement_unit', 'amount')
 
+    def to_representation(self, instance):
+        return recipe_ingredient_representation(instance)
+
 
 class RecipeReadSerializer(serializers.ModelSerializer):
     author = UserReadSerializer(read_only=True)
@@ -102,7 +179,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         many=True, read_only=True, source='recipes')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    image = FeedImageField()
 
     class Meta:
         model = Recipe
@@ -110,9 +187,35 @@ class RecipeReadSerializer(serializers.ModelSerializer):
                   'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
                   'name', 'image',
-                  'text', 'cooking_time')
+                  'text', 'cooking_time',
+                  'favorites_count', 'in_carts_count')
+
+    def to_representation(self, instance):
+        """Собирает ответ напрямую, минуя поля DRF, формат тот же."""
+        author = self.fields['author']
+        return {
+            'id': instance.id,
+            'tags': [tag_representation(tag) for tag in instance.tags.all()],
+            'author': user_representation(
+                instance.author,
+                author.get_is_subscribed(instance.author)),
+            'ingredients': [
+                recipe_ingredient_representation(recipe_ingredient)
+                for recipe_ingredient in instance.recipes.all()
+            ],
+            'is_favorited': self.get_is_favorited(instance),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(instance),
+            'name': instance.name,
+            'image': self.fields['image'].to_representation(instance),
+            'text': instance.text,
+            'cooking_time': instance.cooking_time,
+            'favorites_count': instance.favorites_count,
+            'in_carts_count': instance.in_carts_count,
+        }
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return (
             self.context.get('request').user.is_authenticated
             and Favorite.objects.filter(user=self.context['request'].user,
@@ -120,6 +223,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return (
             self.context.get('request').user.is_authenticated
             and ShoppingCart.objects.filter(
@@ -128,17 +233,50 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             )
 
 
+class RecipeMatchSerializer(RecipeReadSerializer):
+    """Рецепт из подбора по продуктам с числом совпавших ингредиентов."""
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['matched_count'] = instance.matched_count
+        data['missing_count'] = instance.missing_count
+        return data
+
+
+class IngredientMatchSerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(), min_length=1,
+        max_length=BATCH_MAX_SIZE)
+    max_missing = serializers.IntegerField(min_value=0, default=0)
+
+
 class RecipeSubcribeSerializer(serializers.ModelSerializer):
-    image = Base64ImageField()
+    image = RecipeImageField(variant='thumb')
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'name': instance.name,
+            'image': self.fields['image'].to_representation(instance),
+            'cooking_time': instance.cooking_time,
+        }
+
+
+def get_recipes_limit(request):
+    try:
+        recipes_limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return None
+    return max(recipes_limit, 0)
+
 
 class SubscribeSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
-    recipes = RecipeSubcribeSerializer(read_only=True, many=True)
+    recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
 
     class Meta:
@@ -151,6 +289,8 @@ class SubscribeSerializer(serializers.ModelSerializer):
                             'recipes', 'recipes_count')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         if (self.context.get('request')
            and self.context['request'].user.is_authenticated):
             return Subscribe.objects.filter(user=self.context['request'].user,
@@ -158,21 +298,23 @@ class SubscribeSerializer(serializers.ModelSerializer):
         return False
 
     def get_recipes(self, obj):
-        recipes_limit = self.context.get('request').query_params.get('recipes_limit')
-        if recipes_limit is not None:
-            recipes = obj.recipes.all()[:int(recipes_limit)]
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
         else:
             recipes = obj.recipes.all()
-        return RecipeSubcribeSerializer(recipes, many=True).data
+            request = self.context.get('request')
+            recipes_limit = request and get_recipes_limit(request)
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
+        return RecipeSubcribeSerializer(recipes, many=True,
+                                        context=self.context).data
 
     def get_recipes_count(self, obj):
-        author = self.context.get('author')
-        if author is not None:
-            return author.recipes.count()
-        return 0
+        return obj.recipes_count
 
 
 class RecipeFavoriteSerializer(serializers.ModelSerializer):
+    image = RecipeImageField(variant='thumb')
 
     class Meta:
         model = Recipe
@@ -181,36 +323,97 @@ class RecipeFavoriteSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'amount')
 
 
+class UploadedImageSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = UploadedImage
+        fields = ('id', 'image')
+        read_only_fields = ('id',)
+
+    def create(self, validated_data):
+        return UploadedImage.objects.create(
+            user=self.context['request'].user,
+            image=images.store_original(validated_data['image']))
+
+
 class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientCreateSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
-    image = Base64ImageField()
+    tags = serializers.ListField(child=serializers.IntegerField())
+    image = Base64ImageField(required=False)
+    image_id = serializers.UUIDField(write_only=True, required=False)
     author = UserReadSerializer(read_only=True)
 
     class Meta:
         model = Recipe
-        fields = ('id', 'ingredients', 'tags', 'image', 'name', 'text',
-                  'cooking_time', 'author')
+        fields = ('id', 'ingredients', 'tags', 'image', 'image_id', 'name',
+                  'text', 'cooking_time', 'author')
+
+    def validate_image_id(self, value):
+        upload = UploadedImage.objects.filter(
+            pk=value, user=self.context['request'].user).first()
+        if upload is None:
+            raise serializers.ValidationError('Картинка не найдена')
+        return upload
+
+    def validate_ingredients(self, value):
+        ingredients = ingredient_catalog.get_many(
+            item['id'] for item in value)
+        missing = {item['id'] for item in value} - ingredients.keys()
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {sorted(missing)}')
+        for item in value:
+            item['id'] = ingredients[item['id']]
+        return value
+
+    def validate_tags(self, value):
+        tags = tag_catalog.get_many(value)
+        missing = set(value) - tags.keys()
+        if missing:
+            raise serializers.ValidationError(
+                f'Тэги не найдены: {sorted(missing)}')
+        return [tags[pk] for pk in value]
 
     def validate(self, data):
         if not data.get('ingredients'):
             raise serializers.ValidationError('Должен быть хотя бы один ингредиент')
+        if 'image' in data and 'image_id' in data:
+            raise serializers.ValidationError(
+                'Укажите либо image, либо image_id')
+        if (self.instance is None
+                and 'image' not in data and 'image_id' not in data):
+            raise serializers.ValidationError(
+                {'image': ['Обязательное поле.']})
         return data
 
+    def pop_image(self, validated_data):
+        """Имя файла картинки из image_id или из base64-поля image."""
+        upload = validated_data.pop('image_id', None)
+        if upload is not None:
+            return upload.image.name
+        if 'image' in validated_data:
+            return images.store_original(validated_data.pop('image'))
+        return None
+
     @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
         author = self.context['request'].user
-        recipe = Recipe.objects.create(**validated_data, author=author)
+        validated_data['image'] = self.pop_image(validated_data)
+        recipe = Recipe.objects.create(
+            **validated_data, author=author,
+            image_pending=bool(validated_data['image']))
+        images.schedule_variants(recipe)
+        User.objects.filter(pk=author.pk).update(
+            recipes_count=F('recipes_count') + 1)
         recipe.tags.set(tags_data)
         recipe_ingredients = []
         for ingredient_data in ingredients_data:
@@ -228,27 +431,83 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients', [])
         tags_data = validated_data.pop('tags', [])
+        image = self.pop_image(validated_data)
+        if image is not None:
+            validated_data['image'] = image
+            validated_data['image_variants'] = {}
+            validated_data['image_pending'] = True
         super().update(instance, validated_data)
-        instance.tags.set(tags_data)
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        recipe_ingredients = [
-            RecipeIngredient(
-                recipe=instance,
-                ingredient=ingredient_data['id'],
-                amount=ingredient_data['amount']
-            ) for ingredient_data in ingredients_data
-        ]
-        RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        if image is not None:
+            images.schedule_variants(instance)
+        if ({tag.pk for tag in tags_data}
+                != set(instance.tags.values_list('pk', flat=True))):
+            instance.tags.set(tags_data)
+        self.update_ingredients(instance, ingredients_data)
         return instance
 
+    def update_ingredients(self, instance, ingredients_data):
+        """Приводит ингредиенты рецепта к новому составу по разнице.
+
+        Совпадающие строки не трогаются, у измененных обновляется
+        amount, лишние удаляются, новые создаются.
+        """
+        stored = {}
+        old_amounts = Counter()
+        for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=instance).order_by('pk'):
+            stored.setdefault(recipe_ingredient.ingredient_id,
+                              []).append(recipe_ingredient)
+            old_amounts[recipe_ingredient.ingredient_id] += (
+                recipe_ingredient.amount)
+        new_amounts = Counter()
+        to_create, to_update = [], []
+        for ingredient_data in ingredients_data:
+            ingredient = ingredient_data['id']
+            amount = ingredient_data['amount']
+            new_amounts[ingredient.pk] += amount
+            rows = stored.get(ingredient.pk)
+            if not rows:
+                to_create.append(RecipeIngredient(
+                    recipe=instance, ingredient=ingredient, amount=amount))
+                continue
+            recipe_ingredient = rows.pop(0)
+            if recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                to_update.append(recipe_ingredient)
+        to_delete = [recipe_ingredient.pk for rows in stored.values()
+                     for recipe_ingredient in rows]
+        if to_delete:
+            RecipeIngredient.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            RecipeIngredient.objects.bulk_create(to_create)
+        if old_amounts != new_amounts:
+            shopping_list.update_recipe(instance, old_amounts, new_amounts)
+
     def to_representation(self, instance):
         return RecipeReadSerializer(instance,
                                     context=self.context).data
 
 
 class RecipeShoppingCartCreateSerializer(serializers.ModelSerializer):
+    image = RecipeImageField(variant='thumb')
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
+
+
+class BatchChangeSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(),
+                                default=list, max_length=BATCH_MAX_SIZE)
+    remove = serializers.ListField(child=serializers.IntegerField(),
+                                   default=list, max_length=BATCH_MAX_SIZE)
+
+    def validate(self, data):
+        both = set(data['add']) & set(data['remove'])
+        if both:
+            raise serializers.ValidationError(
+                f'id одновременно добавляются и удаляются: {sorted(both)}')
+        return data
@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe
+from users.models import User
+
+from .authentication import invalidate_user_tokens, token_cache
+from .feed_cache import feed_cache
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_changed_user(instance, created, **kwargs):
+    if not created:
+        invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_feed_on_create(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            lambda: feed_cache.invalidate_author(instance.author_id))
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_feed_on_delete(instance, **kwargs):
+    transaction.on_commit(
+        lambda: feed_cache.invalidate_author(instance.author_id))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_feed_on_retag(instance, action, reverse, pk_set, **kwargs):
+    if reverse and action in ('pre_clear', 'post_add', 'post_remove'):
+        # со стороны тэга рецепты не сохраняются: сдвигаем их updated_at,
+        # чтобы сбросить страницы кэша с ними
+        if action == 'pre_clear':
+            recipes = Recipe.objects.filter(tags=instance)
+        else:
+            recipes = Recipe.objects.filter(pk__in=pk_set)
+        recipes.update(updated_at=timezone.now())
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(feed_cache.invalidate_tags)
@@ -0,0 +1,860 @@
+import base64
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.test import (TestCase, TransactionTestCase,
+                         override_settings)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.catalog import (CatalogCache, bump_version, ingredient_catalog,
+                             tag_catalog)
+from recipes.ingredient_index import IngredientIndex
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeScore, ShoppingCart, SimilarRecipe, Tag)
+from recipes.similarity import FeatureStore, rebuild_similar
+from users.models import Subscribe, User
+
+from .authentication import token_cache
+from .feed_cache import FeedCache, FeedPage, feed_cache
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        password='password', first_name=username, last_name=username)
+
+
+def create_recipes(authors, tags, ingredients, count):
+    """count рецептов с тэгами и ингредиентами, без сигналов."""
+    recipes = Recipe.objects.bulk_create(
+        Recipe(name=f'Рецепт {number}', text='Описание', cooking_time=10,
+               author=authors[number % len(authors)],
+               image='images/recipe.png')
+        for number in range(count)
+    )
+    if not recipes[0].pk:
+        recipes = list(Recipe.objects.order_by('pk'))
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe.pk, tag_id=tag.pk)
+        for recipe in recipes for tag in tags
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=10)
+        for recipe in recipes for ingredient in ingredients
+    )
+    return recipes
+
+
+def reset_caches():
+    cache.clear()
+    token_cache.clear()
+    ingredient_catalog.invalidate()
+    tag_catalog.invalidate()
+
+
+def api_client(user=None):
+    client = APIClient()
+    if user is not None:
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+def expire_version_checks():
+    """Следующее обращение к кэшам сверит версии с БД."""
+    feed_cache._checked.clear()
+    for catalog in (ingredient_catalog, tag_catalog):
+        catalog._checked = float('-inf')
+
+
+def pin_version_checks(test):
+    """Версии сверяются с БД только после expire_version_checks()."""
+    for cls in (FeedCache, CatalogCache):
+        patcher = mock.patch.object(cls, 'check_interval', 3600)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    expire_version_checks()
+
+
+class RecipeFeedQueriesTest(TestCase):
+    """Число запросов страницы ленты не зависит от ее размера."""
+    page_sizes = (6, 50, 200)
+    # токен, COUNT, страница, авторы, тэги, ингредиенты
+    shared_queries = 6
+    # версии области ленты, тэгов и ингредиентов, раз в check_interval
+    version_queries = 3
+    # updated_at рецептов страницы из кэша
+    freshness_queries = 1
+    # флаги пользователя поверх общей страницы из кэша
+    personal_flag_queries = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        authors = [create_user(f'author{number}') for number in range(20)]
+        tags = [Tag.objects.create(name=f'Тэг {number}', slug=f'tag{number}',
+                                   color=f'#00000{number}')
+                for number in range(2)]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        recipes = create_recipes(authors, tags, ingredients, 200)
+        Favorite.objects.bulk_create(
+            Favorite(user=cls.user, recipe=recipe) for recipe in recipes[::2])
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in recipes[::3])
+        Subscribe.objects.create(user=cls.user, author=authors[0])
+
+    def setUp(self):
+        reset_caches()
+        pin_version_checks(self)
+        self.client = api_client(self.user)
+
+    def get_page(self, size, query=''):
+        response = self.client.get(f'/api/recipes/?limit={size}{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), size)
+        return response
+
+    def test_personal_page(self):
+        for size in self.page_sizes:
+            with self.subTest(size=size):
+                token_cache.clear()
+                with self.assertNumQueries(self.shared_queries):
+                    self.get_page(size, '&is_in_shopping_cart=0')
+
+    def test_shared_page(self):
+        for size in self.page_sizes:
+            with self.subTest(size=size):
+                token_cache.clear()
+                expire_version_checks()
+                with self.assertNumQueries(self.shared_queries
+                                           + self.version_queries
+                                           + self.personal_flag_queries):
+                    response = self.get_page(size)
+                with self.assertNumQueries(self.freshness_queries
+                                           + self.personal_flag_queries):
+                    self.assertEqual(self.get_page(size).data, response.data)
+
+    def test_flags(self):
+        recipes = self.get_page(200).data['results']
+        favorited = set(Favorite.objects.filter(user=self.user)
+                        .values_list('recipe_id', flat=True))
+        for recipe in recipes:
+            self.assertEqual(recipe['is_favorited'],
+                             recipe['id'] in favorited)
+        self.assertEqual(
+            sum(recipe['author']['is_subscribed'] for recipe in recipes), 10)
+
+
+class FeedCacheTest(TestCase):
+    """Запись сбрасывает только страницы ленты, которые она затронула."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [create_user('first'), create_user('second')]
+        cls.tags = [Tag.objects.create(name=f'Тэг {number}',
+                                       slug=f'tag{number}',
+                                       color=f'#00000{number}')
+                    for number in range(2)]
+        cls.recipes = create_recipes(cls.authors, cls.tags[:1], [], 6)
+
+    def setUp(self):
+        reset_caches()
+        pin_version_checks(self)
+        self.client = APIClient()
+        self.pages = {}
+
+    def load(self, *urls):
+        """{url: была ли страница собрана заново}."""
+        rebuilt = {}
+        for url in urls:
+            with mock.patch.object(FeedPage, 'set', autospec=True,
+                                   side_effect=FeedPage.set) as page_set:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            rebuilt[url] = page_set.called
+        expire_version_checks()
+        return rebuilt
+
+    def test_edit_resets_only_pages_with_recipe(self):
+        first, second = '/api/recipes/?limit=3', '/api/recipes/?limit=3&page=2'
+        self.load(first, second)
+        oldest = Recipe.objects.order_by('pk').first()
+        # так варианты картинки записывает recipes.images
+        Recipe.objects.filter(pk=oldest.pk).update(
+            image_variants={'card': 'images/variants/card.webp'},
+            updated_at=timezone.now())
+        self.assertEqual(self.load(first, second),
+                         {first: False, second: True})
+        self.assertIn('card.webp',
+                      self.client.get(second).data['results'][-1]['image'])
+
+    def test_new_recipe_resets_feed_and_its_author(self):
+        feed = '/api/recipes/'
+        first, second = (f'/api/recipes/?author={author.pk}'
+                         for author in self.authors)
+        self.load(feed, first, second)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_user('other')
+            Recipe.objects.create(name='Новый', text='Описание',
+                                  cooking_time=5, author=self.authors[0],
+                                  image='images/recipe.png')
+        self.assertEqual(self.load(feed, first, second),
+                         {feed: True, first: True, second: False})
+
+    def test_retag_resets_tag_pages(self):
+        tagged = f'/api/recipes/?tags={self.tags[1].slug}'
+        second = f'/api/recipes/?author={self.authors[1].pk}'
+        self.load(tagged, second)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[0].tags.add(self.tags[1])
+        self.assertEqual(self.load(tagged, second),
+                         {tagged: True, second: False})
+        self.assertEqual(len(self.client.get(tagged).data['results']), 1)
+
+    def test_change_from_other_process(self):
+        feed = '/api/recipes/'
+        self.load(feed)
+        bump_version(feed_cache.version_name)
+        self.assertEqual(self.load(feed), {feed: True})
+
+
+class CatalogCacheTest(TestCase):
+    """Версия справочника читается из БД не чаще check_interval."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Завтрак', slug='breakfast',
+                           color='#000001')
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def setUp(self):
+        reset_caches()
+
+    def test_version_checked_once_per_interval(self):
+        with self.assertNumQueries(2):
+            tag_catalog.all()
+        with self.assertNumQueries(0):
+            tag_catalog.all()
+            tag_catalog.get_many([tag.pk for tag in tag_catalog.all()])
+
+    def test_change_from_other_process(self):
+        version, _ = tag_catalog.version()
+        tag_catalog.bump_version()
+        self.assertEqual(tag_catalog.version()[0], version)
+        tag_catalog._checked -= tag_catalog.check_interval
+        self.assertEqual(tag_catalog.version()[0], version + 1)
+
+    def test_ingredients_not_loaded_whole(self):
+        with self.assertRaises(TypeError):
+            ingredient_catalog.all()
+        response = APIClient().get('/api/ingredients/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.data], ['Соль'])
+        etag = response['ETag']
+        response = APIClient().get('/api/ingredients/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class IngredientIndexTest(TestCase):
+    """Индекс подбора сверяет версию с БД и не строится в запросе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.recipes = create_recipes([author], [], cls.ingredients, 5)
+
+    def setUp(self):
+        self.index = IngredientIndex()
+        self.ids = [ingredient.pk for ingredient in self.ingredients]
+
+    def matched(self):
+        return {recipe_id for recipe_id, _, _ in self.index.match(self.ids)}
+
+    def test_built_once(self):
+        self.assertEqual(len(self.matched()), 5)
+        with self.assertNumQueries(0):
+            self.matched()
+
+    def test_change_from_other_process(self):
+        self.matched()
+        recipe = self.recipes[0]
+        RecipeIngredient.objects.filter(recipe=recipe).delete()
+        Recipe.objects.filter(pk=recipe.pk).update(updated_at=timezone.now())
+        bump_version(IngredientIndex.version_name)
+        self.assertIn(recipe.pk, self.matched())
+        self.index._checked -= self.index.check_interval
+        self.assertNotIn(recipe.pk, self.matched())
+
+    def test_expired_snapshot_served_while_rebuilding(self):
+        self.matched()
+        self.index._expires = 0
+        with mock.patch.object(self.index, '_start_rebuild') as rebuild:
+            with self.assertNumQueries(0):
+                self.assertEqual(len(self.matched()), 5)
+                self.matched()
+        rebuild.assert_called_once_with()
+
+
+class RecipeUpdateWritesTest(TestCase):
+    """PATCH рецепта пишет только изменившиеся строки."""
+    write_statements = ('INSERT', 'UPDATE', 'DELETE')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tags = [Tag.objects.create(name=f'Тэг {number}',
+                                       slug=f'tag{number}',
+                                       color=f'#00000{number}')
+                    for number in range(3)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(4)
+        ]
+        cls.recipe = create_recipes([cls.author], cls.tags[:2],
+                                    cls.ingredients[:3], 1)[0]
+
+    def setUp(self):
+        reset_caches()
+        self.client = api_client(self.author)
+
+    def patch(self, amounts, tags=None, name='Рецепт'):
+        """PATCH с ингредиентами {номер: amount}, возвращает записи."""
+        data = {
+            'name': name,
+            'ingredients': [{'id': self.ingredients[number].pk,
+                             'amount': amount}
+                            for number, amount in amounts.items()],
+            'tags': [tag.pk for tag in tags or self.tags[:2]],
+        }
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(f'/api/recipes/{self.recipe.pk}/',
+                                         data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        # пустой UPDATE ... WHERE 0 - блокировка User.objects.lock()
+        # в SQLite, строк он не пишет
+        return [query['sql'] for query in context.captured_queries
+                if query['sql'].startswith(self.write_statements)
+                and not query['sql'].endswith('WHERE 0')]
+
+    def stored(self):
+        return dict(RecipeIngredient.objects.filter(recipe=self.recipe)
+                    .values_list('ingredient_id', 'pk'))
+
+    def assert_writes(self, writes, *expected):
+        """Сравнивает записи как пары (оператор, таблица)."""
+        self.assertEqual(
+            [re.match(r'(\w+).*?"(\w+)"', sql).groups() for sql in writes],
+            list(expected))
+
+    def test_name_only(self):
+        rows = self.stored()
+        writes = self.patch({0: 10, 1: 10, 2: 10}, name='Новое название')
+        self.assert_writes(writes, ('UPDATE', 'recipes_recipe'))
+        self.assertEqual(self.stored(), rows)
+
+    def test_amount_changed(self):
+        rows = self.stored()
+        writes = self.patch({0: 10, 1: 25, 2: 10})
+        self.assert_writes(writes, ('UPDATE', 'recipes_recipe'),
+                           ('UPDATE', 'recipes_recipeingredient'))
+        self.assertEqual(self.stored(), rows)
+        self.assertEqual(
+            RecipeIngredient.objects.get(pk=rows[self.ingredients[1].pk])
+            .amount, 25)
+
+    def test_ingredient_replaced(self):
+        rows = self.stored()
+        writes = self.patch({0: 10, 1: 10, 3: 5})
+        self.assert_writes(writes, ('UPDATE', 'recipes_recipe'),
+                           ('DELETE', 'recipes_recipeingredient'),
+                           ('INSERT', 'recipes_recipeingredient'))
+        stored = self.stored()
+        for ingredient in self.ingredients[:2]:
+            self.assertEqual(stored[ingredient.pk], rows[ingredient.pk])
+        self.assertNotIn(self.ingredients[2].pk, stored)
+        self.assertIn(self.ingredients[3].pk, stored)
+
+    def test_tags_changed(self):
+        writes = self.patch({0: 10, 1: 10, 2: 10}, tags=self.tags[1:])
+        self.assert_writes(writes, ('UPDATE', 'recipes_recipe'),
+                           ('DELETE', 'recipes_recipe_tags'),
+                           ('INSERT', 'recipes_recipe_tags'))
+
+
+class SimilarRecipesTest(TestCase):
+    """Пересчет похожих рецептов, полный и по изменившимся рецептам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.tags = [Tag.objects.create(name=f'Тэг {number}',
+                                       slug=f'tag{number}',
+                                       color=f'#00000{number}')
+                    for number in range(2)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(6)
+        ]
+        cls.recipes = create_recipes([author], [], [], 4)
+
+    def compose(self, recipe, ingredients=(), tags=()):
+        RecipeIngredient.objects.filter(recipe=recipe).delete()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe,
+                             ingredient=self.ingredients[number], amount=1)
+            for number in ingredients)
+        recipe.tags.set([self.tags[number] for number in tags])
+
+    def similar(self, recipe):
+        return set(SimilarRecipe.objects.filter(recipe=recipe)
+                   .values_list('similar_id', flat=True))
+
+    def rebuild_changed(self, *recipes):
+        with mock.patch.object(FeatureStore, 'load_all',
+                               side_effect=AssertionError):
+            rebuild_similar(changed_ids=[recipe.pk for recipe in recipes])
+
+    def test_shared_tags_only(self):
+        first, second, third, _ = self.recipes
+        self.compose(first, tags=[0])
+        self.compose(second, tags=[0])
+        self.compose(third, ingredients=[0], tags=[1])
+        rebuild_similar()
+        self.assertEqual(self.similar(first), {second.pk})
+
+    def test_changed_recipe_leaves_stored_list(self):
+        first, second, third, fourth = self.recipes
+        self.compose(first, ingredients=[0, 1, 2])
+        self.compose(second, ingredients=[0, 1, 2])
+        self.compose(third, ingredients=[3, 4])
+        self.compose(fourth, ingredients=[3, 4])
+        rebuild_similar()
+        self.assertEqual(self.similar(first), {second.pk})
+        # first пересчитывается по сохраненной ссылке на second
+        self.compose(second, ingredients=[5])
+        self.rebuild_changed(second)
+        self.assertEqual(self.similar(first), set())
+        self.assertEqual(self.similar(second), set())
+
+    def test_changed_recipe_enters_other_lists(self):
+        first, second, third, fourth = self.recipes
+        self.compose(first, ingredients=[0, 1, 2])
+        self.compose(second, ingredients=[3])
+        self.compose(third, ingredients=[4])
+        self.compose(fourth, ingredients=[5])
+        rebuild_similar()
+        self.assertEqual(self.similar(first), set())
+        self.compose(fourth, ingredients=[0, 1])
+        self.rebuild_changed(fourth)
+        self.assertEqual(self.similar(first), {fourth.pk})
+        self.assertEqual(self.similar(fourth), {first.pk})
+
+
+class ImageQueueTest(TestCase):
+    """Варианты картинок создаются из очереди image_pending."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Тэг', slug='tag', color='#000000')
+        cls.ingredient = Ingredient.objects.create(name='Ингредиент',
+                                                   measurement_unit='г')
+        cls.recipe = create_recipes([cls.author], [cls.tag],
+                                    [cls.ingredient], 1)[0]
+
+    def setUp(self):
+        reset_caches()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name,
+                                     IMAGE_PROCESSING_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), 'red').save(buffer, 'PNG')
+        image = base64.b64encode(buffer.getvalue()).decode()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = api_client(self.author).patch(
+                f'/api/recipes/{self.recipe.pk}/', {
+                    'name': 'Рецепт',
+                    'image': f'data:image/png;base64,{image}',
+                    'ingredients': [{'id': self.ingredient.pk,
+                                     'amount': 10}],
+                    'tags': [self.tag.pk],
+                }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.recipe.refresh_from_db()
+
+    def process(self):
+        call_command('process_recipe_images', stdout=StringIO(),
+                     stderr=StringIO())
+        self.recipe.refresh_from_db()
+
+    def test_upload_is_queued_and_processed(self):
+        self.upload()
+        self.assertTrue(self.recipe.image_pending)
+        self.assertEqual(self.recipe.image_variants, {})
+        self.process()
+        self.assertFalse(self.recipe.image_pending)
+        self.assertEqual(set(self.recipe.image_variants),
+                         {'thumb', 'card', 'webp'})
+        for name in self.recipe.image_variants.values():
+            self.assertTrue(default_storage.exists(name))
+
+    def test_broken_image_leaves_queue(self):
+        name = default_storage.save('images/broken.png',
+                                    ContentFile(b'not an image'))
+        Recipe.objects.filter(pk=self.recipe.pk).update(image=name,
+                                                        image_pending=True)
+        self.process()
+        self.assertFalse(self.recipe.image_pending)
+        self.assertEqual(self.recipe.image_variants, {})
+
+
+class QueryPlanTest(TestCase):
+    """Запросы горячих эндпоинтов идут по индексам.
+
+    Каждый SELECT эндпоинта прогоняется через EXPLAIN на данных, по
+    объему и распределению похожих на рабочие, после ANALYZE. Полным
+    чтением большой таблицы считается:
+
+    - в PostgreSQL - Seq Scan (enable_seqscan = off, поэтому он
+      означает, что подходящего индекса нет) и Index Scan или Index
+      Only Scan без Index Cond;
+    - в SQLite - любой SCAN таблицы, в том числе USING INDEX и
+      USING COVERING INDEX.
+
+    Исключение - таблицы ordered: первая страница ленты читает их
+    в порядке индекса, и чтение обрывает LIMIT. Это допускается,
+    только если в плане нет сортировки (Sort, USE TEMP B-TREE), то
+    есть порядок страницы целиком дает индекс. COUNT(*) страничной
+    пагинации читает все подходящие рецепты в любой СУБД, он
+    пропускается только с full_count; курсорная пагинация его не
+    делает. SQLite печатает в плане псевдонимы подзапросов (U0, T3),
+    они сопоставляются с таблицами по тексту запроса.
+    """
+    large_tables = {
+        'recipes_recipe', 'recipes_favorite', 'recipes_shoppingcart',
+        'recipes_recipeingredient', 'recipes_recipe_tags',
+        'recipes_recipescore', 'users_subscribe', 'recipes_ingredient',
+        'users_user',
+    }
+    users = 2000
+    authors = 200
+    recipes = 10000
+    ingredients = 2000
+    sqlite_scan = re.compile(
+        r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?(?P<index> USING .*INDEX)?')
+    sqlite_alias = re.compile(r'(?:FROM|JOIN) "(\w+)" (?:AS )?"?([A-Z]\d+)\b')
+    # узлы PostgreSQL, которые дочитывают вход до конца
+    blocking_nodes = {'Aggregate', 'Hash', 'Materialize', 'Sort',
+                      'Incremental Sort', 'Unique', 'SetOp', 'WindowAgg'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        User.objects.bulk_create(
+            User(username=f'user{number}', email=f'user{number}@example.com',
+                 first_name='user', last_name='user', password='!')
+            for number in range(cls.users))
+        users = list(User.objects.exclude(pk=cls.user.pk).order_by('pk'))
+        cls.authors = users[:cls.authors]
+        cls.tags = [Tag.objects.create(name=f'Тэг {number}',
+                                       slug=f'tag{number}',
+                                       color=f'#0000{number:02}')
+                    for number in range(10)]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(cls.ingredients))
+        ingredient_ids = list(Ingredient.objects.order_by('pk')
+                              .values_list('pk', flat=True))
+        Recipe.objects.bulk_create(
+            Recipe(name=f'Рецепт {number}', text='Описание',
+                   cooking_time=10, image='images/recipe.png',
+                   author=cls.authors[number % len(cls.authors)])
+            for number in range(cls.recipes))
+        recipe_ids = list(Recipe.objects.order_by('pk')
+                          .values_list('pk', flat=True))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe_id,
+                                tag_id=cls.tags[(number + shift) % 10].pk)
+            for number, recipe_id in enumerate(recipe_ids)
+            for shift in (0, 3))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe_id=recipe_id, amount=10,
+                ingredient_id=ingredient_ids[
+                    (number * 7 + shift * 13) % len(ingredient_ids)])
+            for number, recipe_id in enumerate(recipe_ids)
+            for shift in range(6))
+        RecipeScore.objects.bulk_create(
+            RecipeScore(recipe_id=recipe_id, popular=recipe_id % 7,
+                        trending=recipe_id % 5)
+            for recipe_id in recipe_ids)
+        # у каждого пользователя немного избранного, корзины и подписок,
+        # как в рабочей базе
+        readers = [cls.user] + users
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe_id=recipe_ids[
+                (number * 31 + step * 997) % len(recipe_ids)])
+            for number, user in enumerate(readers) for step in range(10))
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe_id=recipe_ids[
+                (number * 17 + step * 389) % len(recipe_ids)])
+            for number, user in enumerate(readers) for step in range(3))
+        Subscribe.objects.bulk_create(
+            Subscribe(user=user, author=cls.authors[
+                (number + step * 41) % len(cls.authors)])
+            for number, user in enumerate(readers) for step in range(5))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f'EXPLAIN не поддерживается для {connection.vendor}')
+        reset_caches()
+        self.client = api_client(self.user)
+
+    def full_scans(self, sql, ordered=()):
+        """Большие таблицы, которые запрос читает целиком."""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+                tables = self.postgresql_scans(
+                    cursor.fetchone()[0][0]['Plan'], set(ordered))
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                tables = self.sqlite_scans(
+                    sql, [row[-1] for row in cursor.fetchall()],
+                    set(ordered))
+        return tables & self.large_tables
+
+    def postgresql_scans(self, node, ordered, limited=False):
+        kind = node['Node Type']
+        tables = set()
+        if kind == 'Seq Scan' or (
+                kind in ('Index Scan', 'Index Only Scan')
+                and 'Index Cond' not in node
+                and not (limited and node['Relation Name'] in ordered)):
+            tables.add(node['Relation Name'])
+        if kind == 'Limit':
+            limited = True
+        elif kind in self.blocking_nodes:
+            limited = False
+        for child in node.get('Plans', ()):
+            tables |= self.postgresql_scans(child, ordered, limited)
+        return tables
+
+    def sqlite_scans(self, sql, plan, ordered):
+        aliases = {alias: table
+                   for table, alias in self.sqlite_alias.findall(sql)}
+        in_index_order = (' LIMIT ' in sql and not any(
+            'USE TEMP B-TREE' in line for line in plan))
+        tables = set()
+        for line in plan:
+            match = self.sqlite_scan.match(line.strip())
+            if match is None:
+                continue
+            table = aliases.get(match[1], match[1])
+            if match['index'] and in_index_order and table in ordered:
+                continue
+            tables.add(table)
+        return tables
+
+    def assert_indexed(self, url, ordered=(), full_count=False):
+        token_cache.clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for query in context.captured_queries:
+            if not query['sql'].startswith('SELECT') or (
+                    full_count and query['sql'].startswith('SELECT COUNT(')):
+                continue
+            with self.subTest(url=url, sql=query['sql']):
+                self.assertFalse(self.full_scans(query['sql'], ordered))
+
+    def test_detects_full_scans(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertEqual(
+            self.full_scans('SELECT U0."id" FROM "recipes_favorite" U0 '
+                            'WHERE U0."recipe_id" + 0 > 0'),
+            {'recipes_favorite'})
+        self.assertEqual(
+            self.full_scans('SELECT "id" FROM "recipes_ingredient" '
+                            'ORDER BY "name", "measurement_unit"'),
+            {'recipes_ingredient'})
+        self.assertEqual(
+            self.full_scans('SELECT "id" FROM "recipes_ingredient" '
+                            'WHERE "id" = 1'),
+            set())
+        # порядок страницы не дает индекс: сортируются все строки
+        self.assertEqual(
+            self.full_scans('SELECT "id" FROM "recipes_recipe" '
+                            'ORDER BY "pub_date" DESC, "name" LIMIT 7',
+                            ordered={'recipes_recipe'}),
+            {'recipes_recipe'})
+
+    def test_recipe_feed(self):
+        self.assert_indexed('/api/recipes/', ordered={'recipes_recipe'},
+                            full_count=True)
+        self.assert_indexed('/api/recipes/?pagination=cursor',
+                            ordered={'recipes_recipe'})
+
+    def test_author_page(self):
+        self.assert_indexed(f'/api/recipes/?author={self.authors[3].pk}')
+
+    def test_tag_filter(self):
+        self.assert_indexed(f'/api/recipes/?tags={self.tags[4].slug}'
+                            '&pagination=cursor',
+                            ordered={'recipes_recipe'})
+
+    def test_user_filters(self):
+        self.assert_indexed('/api/recipes/?is_favorited=1')
+        self.assert_indexed('/api/recipes/?is_in_shopping_cart=1')
+
+    def test_score_ordering(self):
+        self.assert_indexed('/api/recipes/?ordering=popular'
+                            '&pagination=cursor',
+                            ordered={'recipes_recipescore'})
+        self.assert_indexed('/api/recipes/?ordering=trending'
+                            '&pagination=cursor',
+                            ordered={'recipes_recipescore'})
+
+    def test_recipe_detail(self):
+        recipe = Recipe.objects.order_by('pk').last()
+        self.assert_indexed(f'/api/recipes/{recipe.pk}/')
+
+    def test_subscriptions(self):
+        self.assert_indexed('/api/users/subscriptions/?recipes_limit=3')
+
+    def test_ingredient_prefix_search(self):
+        self.assert_indexed('/api/ingredients/?name=Ингредиент 1')
+        self.assert_indexed('/api/ingredients/?name=Ингредиент 19')
+
+    def test_ingredient_contains_search(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Поиск по подстроке идет по индексу только в '
+                          'PostgreSQL (pg_trgm)')
+        self.assert_indexed('/api/ingredients/?name=диент 4')
+
+
+class ConcurrentToggleTest(TransactionTestCase):
+    """Параллельные переключения избранного, корзины и подписки.
+
+    Каждый запрос идет из своего потока со своим соединением. В
+    PostgreSQL изменения упорядочивает блокировка строки пользователя,
+    в SQLite - блокировка записи всей базы (UserQuerySet.lock), для
+    этого тестовая база SQLite - файл (settings.DATABASES).
+    """
+    workers = 8
+    repeats = 5
+
+    def setUp(self):
+        reset_caches()
+        self.author = create_user('author')
+        self.users = [create_user(f'user{number}') for number in range(8)]
+        self.clients = {user.pk: api_client(user) for user in self.users}
+        self.recipe = create_recipes([self.author], [], [], 1)[0]
+
+    def run_parallel(self, method, url, users):
+        def send(user):
+            try:
+                return getattr(self.clients[user.pk], method)(url).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return list(executor.map(send, users))
+
+    def assert_toggle(self, url, model, counter):
+        user = self.users[0]
+        statuses = self.run_parallel('post', url, [user] * self.workers)
+        self.assertEqual(sorted(statuses),
+                         [201] + [400] * (self.workers - 1))
+        self.assertEqual(model.objects.filter(user=user).count(), 1)
+
+        others = self.users[1:] * self.repeats
+        statuses = self.run_parallel('post', url, others)
+        self.assertEqual(sorted(statuses),
+                         [201] * (len(self.users) - 1)
+                         + [400] * (len(others) - len(self.users) + 1))
+        self.assertEqual(model.objects.count(), len(self.users))
+
+        everyone = self.users * self.repeats
+        statuses = self.run_parallel('delete', url, everyone)
+        self.assertEqual(sorted(statuses),
+                         [204] * len(self.users)
+                         + [400] * (len(everyone) - len(self.users)))
+        self.assertFalse(model.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(getattr(self.recipe, counter), 0)
+
+    def test_favorite(self):
+        self.assert_toggle(f'/api/recipes/{self.recipe.pk}/favorite/',
+                           Favorite, 'favorites_count')
+
+    def test_shopping_cart(self):
+        self.assert_toggle(f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+                           ShoppingCart, 'in_carts_count')
+
+    def test_counters_under_mixed_toggles(self):
+        url = f'/api/recipes/{self.recipe.pk}/favorite/'
+        methods = ['post', 'delete'] * (self.workers * self.repeats // 2)
+
+        def send(method):
+            try:
+                return getattr(self.clients[self.users[0].pk],
+                               method)(url).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            statuses = list(executor.map(send, methods))
+        self.assertLessEqual(set(statuses), {201, 204, 400})
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count,
+                         Favorite.objects.count())
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        statuses = self.run_parallel('post', url,
+                                     self.users * self.repeats)
+        self.assertEqual(set(statuses), {201})
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, len(self.users))
+        self.assertEqual(
+            Subscribe.objects.filter(author=self.author).count(),
+            len(self.users))
@@ -3,26 +3,60 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from users.models import User, Subscribe
-from recipes.models import Tag, Ingredient, Recipe, Favorite, ShoppingCart
+from recipes.models import (Tag, Ingredient, Recipe, Favorite, ShoppingCart,
+                            SimilarRecipe)
+from recipes import shopping_list
+from recipes.ingredient_index import ingredient_index
+from recipes import timeline
+from recipes.catalog import (catalog_versions, ingredient_catalog,
+                             tag_catalog)
 from .serializers import (UserReadSerializer, UserCreateSerializer,
                           SetPasswordSerializer, TagsReadSerializer,
+                          get_recipes_limit,
                           IngredientsReadSerializer, RecipeReadSerializer,
                           SubscribeSerializer, RecipeFavoriteSerializer,
                           RecipeCreateUpdateSerializer,
-                          RecipeShoppingCartCreateSerializer)
+                          RecipeShoppingCartCreateSerializer,
+                          UploadedImageSerializer, BatchChangeSerializer,
+                          IngredientMatchSerializer, RecipeMatchSerializer,
+                          RecipeSubcribeSerializer)
 from rest_framework.permissions import AllowAny
-from .pagination import CustomPaginator
-from rest_framework import mixins, status, filters
+from .pagination import (CustomPaginator, CursorPaginationMixin,
+                         RecipeCursorPaginator, SubscriptionCursorPaginator,
+                         TimelinePaginator)
+from rest_framework import mixins, status
 from django_filters.rest_framework import DjangoFilterBackend
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from .filters import RecipeFilter
-import csv
-from django.http import HttpResponse
+from .filters import IngredientSearchFilter, RecipeFilter
 from .permissions import IsAllowOrAuthorOrAuthorized
-from django.db.models import Sum
+from .exporters import SHOPPING_LIST_RENDERERS, stream_shopping_list
+from .parsers import ImageUploadParser
+from .conditional import make_etag, not_modified, set_validators
+from .feed_cache import feed_cache
+from .batch import change_relations, lock_users, shift_counter
+from rest_framework.parsers import MultiPartParser
+from django.db import IntegrityError, transaction
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Subquery, Value)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def create_unique(model, **fields):
+    """Создает запись, False если такая уже есть.
+
+    Повтор отсекает уникальное ограничение модели, а не проверка
+    перед вставкой, поэтому параллельные запросы не создают дублей.
+    """
+    try:
+        with transaction.atomic():
+            model.objects.create(**fields)
+    except IntegrityError:
+        return False
+    return True
+
+
+class UserViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     permission_classes = (AllowAny, )
     pagination_class = CustomPaginator
@@ -62,78 +96,255 @@ class UserViewSet(viewsets.ModelViewSet):
             if author == request.user:
                 return Response(
                     {'error': 'Нельзя подписываться на самого себя'})
-            serilizer = SubscribeSerializer(author, data=request.data,
+            with transaction.atomic():
+                lock_users([user.pk, author.pk])
+                if create_unique(Subscribe, author=author, user=user):
+                    User.objects.filter(pk=author.pk).update(
+                        followers_count=F('followers_count') + 1)
+                    timeline.follow(user, [author.pk])
+            serilizer = SubscribeSerializer(author,
                                             context={'request': request})
-            serilizer.is_valid(raise_exception=True)
-            Subscribe.objects.get_or_create(author=author, user=user)
             return Response(serilizer.data, status=status.HTTP_201_CREATED)
         if request.method == 'DELETE':
-            Subscribe.objects.filter(author=author, user=user).delete()
+            with transaction.atomic():
+                lock_users([user.pk, author.pk])
+                deleted, _ = Subscribe.objects.filter(author=author,
+                                                      user=user).delete()
+                if deleted:
+                    User.objects.filter(pk=author.pk).update(
+                        followers_count=F('followers_count') - deleted)
+                    timeline.unfollow(user, [author.pk])
             return Response({'detail': 'Вы отписались'},
                             status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['post'], url_path='subscribe/batch',
+            permission_classes=(IsAuthenticated, ))
+    def subscribe_batch(self, request):
+        serializer = BatchChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add = serializer.validated_data['add']
+        remove = serializer.validated_data['remove']
+        with transaction.atomic():
+            lock_users({request.user.pk, *add, *remove})
+            results, added, removed = change_relations(
+                Subscribe, request.user, 'author', add, remove,
+                targets=User.objects.all(),
+                forbidden={request.user.pk})
+            shift_counter(User.objects.all(), 'followers_count',
+                          added, removed)
+            timeline.follow(request.user, added)
+            timeline.unfollow(request.user, removed)
+        return Response({'results': results})
+
     @action(detail=False, methods=['get'],
             permission_classes=(IsAuthenticated, ),
-            pagination_class=CustomPaginator)
+            pagination_class=CustomPaginator,
+            cursor_pagination_class=SubscriptionCursorPaginator)
     def subscriptions(self, request):
-        queryset = User.objects.filter(following__user=request.user)
+        recipes = Recipe.objects.only('id', 'name', 'image', 'image_variants',
+                                      'cooking_time', 'author_id')
+        recipes_limit = get_recipes_limit(request)
+        if recipes_limit is not None:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(author=OuterRef('author'))
+                .order_by('-pub_date', '-id')
+                .values('pk')[:recipes_limit]
+            ))
+        queryset = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            subscription_id=F('following__id'),
+        ).with_subscription(request.user).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        ).order_by('-subscription_id')
         page = self.paginate_queryset(queryset)
         serializer = SubscribeSerializer(page, many=True,
                                          context={'request': request})
         return self.get_paginated_response(serializer.data)
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+class CatalogViewSetMixin:
+    catalog = None
+
+    def use_catalog(self):
+        return self.catalog.load_all
+
+    def get_etag(self, request, version):
+        return make_etag(self.catalog.name, version,
+                         request.get_full_path(),
+                         request.accepted_renderer.format)
+
+    def list(self, request, *args, **kwargs):
+        objects = None
+        if self.use_catalog():
+            objects, version, updated_at = self.catalog.snapshot()
+        else:
+            version, updated_at = self.catalog.version()
+        etag = self.get_etag(request, version)
+        response = not_modified(request, etag, updated_at)
+        if response is None and objects is None:
+            response = super().list(request, *args, **kwargs)
+        elif response is None:
+            serializer = self.get_serializer(objects, many=True)
+            response = Response(serializer.data)
+        return set_validators(response, etag, updated_at)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            pk = int(self.kwargs[self.lookup_field])
+        except ValueError:
+            raise Http404
+        obj, version, updated_at = self.catalog.get_versioned(pk)
+        if obj is None:
+            raise Http404
+        self.check_object_permissions(request, obj)
+        etag = self.get_etag(request, version)
+        response = not_modified(request, etag, updated_at)
+        if response is None:
+            response = Response(self.get_serializer(obj).data)
+        return set_validators(response, etag, updated_at)
+
+
+class TagsViewSet(CatalogViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagsReadSerializer
     permission_classes = [AllowAny, ]
     pagination_class = None
+    catalog = tag_catalog
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientsReadSerializer
     permission_classes = [AllowAny, ]
     pagination_class = None
-    search_fields = ('^name', )
-    filter_backends = (filters.SearchFilter, )
+    filter_backends = (IngredientSearchFilter, )
+    catalog = ingredient_catalog
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = [IsAllowOrAuthorOrAuthorized, ]
     pagination_class = CustomPaginator
+    cursor_pagination_class = RecipeCursorPaginator
     filter_backends = [DjangoFilterBackend, ]
     filterset_class = RecipeFilter
     http_method_names = ['get', 'post', 'patch', 'delete', 'create']
 
+    def get_queryset(self):
+        return Recipe.objects.for_feed(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        cached = feed_cache.page(request)
+        if cached is None:
+            return super().list(request, *args, **kwargs)
+        data = cached.get()
+        if data is None:
+            data, recipes = self.shared_page(request)
+            cached.set(data, recipes)
+        return Response(feed_cache.personalize(data, request.user))
+
+    def shared_page(self, request):
+        """Страница списка в виде для анонимного пользователя и ее рецепты."""
+        queryset = self.filter_queryset(
+            Recipe.objects.for_feed(AnonymousUser()))
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data).data, page
+
+    def get_recipe_etag(self, request, pk):
+        """ETag рецепта по дешевому срезу данных, влияющих на ответ."""
+        user = request.user
+        if user.is_authenticated:
+            is_subscribed = Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('author')))
+        else:
+            is_subscribed = Value(False, output_field=BooleanField())
+        stamp = (
+            Recipe.objects.filter(pk=pk)
+            .with_user_flags(user)
+            .annotate(author_is_subscribed=is_subscribed)
+            .values('updated_at', 'favorites_count', 'in_carts_count',
+                    'is_favorited', 'is_in_shopping_cart',
+                    'author_is_subscribed', 'author__email',
+                    'author__username', 'author__first_name',
+                    'author__last_name', 'author__recipes_count',
+                    'author__followers_count')
+            .first()
+        )
+        if stamp is None:
+            return None
+        return make_etag(stamp, catalog_versions(tag_catalog,
+                                                 ingredient_catalog),
+                         request.accepted_renderer.format)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            pk = int(kwargs['pk'])
+        except ValueError:
+            raise Http404
+        etag = self.get_recipe_etag(request, pk)
+        if etag is None:
+            return super().retrieve(request, *args, **kwargs)
+        response = not_modified(request, etag)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return set_validators(response, etag)
+
     def get_serializer_class(self):
         if self.action in ('retrieve', 'list'):
             return RecipeReadSerializer
         else:
             return RecipeCreateUpdateSerializer
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        shopping_list.delete_recipe(instance)
+        instance.delete()
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') - 1)
+
+    @action(detail=False, permission_classes=(IsAuthenticated, ),
+            methods=['post'], url_path='images',
+            parser_classes=(MultiPartParser, ImageUploadParser))
+    def upload_image(self, request):
+        image = request.data.get('image') or request.data.get('file')
+        serializer = UploadedImageSerializer(data={'image': image},
+                                             context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, permission_classes=(IsAuthenticated, ),
             methods=['post', 'delete'])
     def favorite(self, request, **kwargs):
         recipe = get_object_or_404(Recipe, id=kwargs['pk'])
         if request.method == 'POST':
-            if Favorite.objects.filter(user=request.user, recipe=recipe):
-                return Response(
-                    {"error": "Рецепт уже есть в избранном"}
-                )
-            serializer = RecipeFavoriteSerializer(recipe, data=request.data,
+            with transaction.atomic():
+                lock_users([request.user.pk])
+                if not create_unique(Favorite, recipe=recipe,
+                                     user=request.user):
+                    return Response(
+                        {"error": "Рецепт уже есть в избранном"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    favorites_count=F('favorites_count') + 1)
+            serializer = RecipeFavoriteSerializer(recipe,
                                                   context={'request': request})
-            serializer.is_valid(raise_exception=True)
-            Favorite.objects.create(recipe=recipe, user=request.user)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if request.method == 'DELETE':
-            if not Favorite.objects.filter(user=request.user,
-                                           recipe=recipe).exists():
-                return Response(
-                    {"error": "Рецепта нет в избранном"}
+            with transaction.atomic():
+                lock_users([request.user.pk])
+                deleted, _ = Favorite.objects.filter(user=request.user,
+                                                     recipe=recipe).delete()
+                if not deleted:
+                    return Response(
+                        {"error": "Рецепта нет в избранном"},
+                        status=status.HTTP_400_BAD_REQUEST
                     )
-            Favorite.objects.filter(user=request.user, recipe=recipe).delete()
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    favorites_count=F('favorites_count') - deleted)
             return Response({'detail': 'Рецепт удален из избранного'},
                             status=status.HTTP_204_NO_CONTENT)
 
@@ -142,47 +353,137 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def shopping_cart(self, request, **kwargs):
         recipe = get_object_or_404(Recipe, id=kwargs['pk'])
         if request.method == 'POST':
-            if ShoppingCart.objects.filter(user=request.user, recipe=recipe):
-                return Response(
-                    {"error": "Рецепт уже в списках покупок"}
-                )
-            serializer = RecipeShoppingCartCreateSerializer(recipe,
-                                                            data=request.data,
-                                                            context={'request':
-                                                                     request})
-            serializer.is_valid(raise_exception=True)
-            ShoppingCart.objects.create(recipe=recipe,
-                                        user=request.user)
+            with transaction.atomic():
+                lock_users([request.user.pk])
+                if not create_unique(ShoppingCart, recipe=recipe,
+                                     user=request.user):
+                    return Response(
+                        {"error": "Рецепт уже в списках покупок"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                shopping_list.add_recipe(request.user, recipe)
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    in_carts_count=F('in_carts_count') + 1)
+            serializer = RecipeShoppingCartCreateSerializer(
+                recipe, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            if not ShoppingCart.objects.filter(recipe=recipe,
-                                               user=request.user).exists():
-                return Response(
-                    {"error": "Рецепта нет в списках покупок"}
-                )
-            ShoppingCart.objects.filter(recipe=recipe,
-                                        user=request.user).delete()
+            with transaction.atomic():
+                lock_users([request.user.pk])
+                deleted, _ = ShoppingCart.objects.filter(
+                    recipe=recipe, user=request.user).delete()
+                if not deleted:
+                    return Response(
+                        {"error": "Рецепта нет в списках покупок"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                shopping_list.remove_recipe(request.user, recipe)
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    in_carts_count=F('in_carts_count') - deleted)
             return Response(
-                {'detail': 'Рецепт удален из списка покупок'}
+                {'detail': 'Рецепт удален из списка покупок'},
+                status=status.HTTP_204_NO_CONTENT
             )
 
-    @action(detail=False, permission_classes=(IsAuthenticated, ),
-            methods=['get'])
-    def download_shopping_cart(self, request, **kwargs):
-        shopping_cart = (
-            request.user.shopping_user
-            .values('recipe__recipes__ingredient__name')
-            .annotate(amount=Sum('recipe__recipes__amount'))
-            .order_by('recipe__recipes__ingredient__name')
+    @action(detail=False, methods=['get'],
+            permission_classes=(IsAuthenticated, ))
+    def feed(self, request):
+        """Рецепты авторов из подписок, от новых к старым."""
+        paginator = TimelinePaginator()
+        page_size = paginator.get_page_size(request)
+        page = timeline.timeline(request.user, page_size,
+                                 paginator.get_position(request))
+        recipes = Recipe.objects.for_feed(request.user).in_bulk(
+            [recipe_id for _, recipe_id in page])
+        serializer = RecipeReadSerializer(
+            [recipes[recipe_id] for _, recipe_id in page
+             if recipe_id in recipes],
+            many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(request, serializer.data,
+                                                page, page_size)
+
+    @action(detail=False, methods=['get'], url_path='match',
+            cursor_pagination_class=None)
+    def match(self, request):
+        """Подбор рецептов по имеющимся ингредиентам."""
+        serializer = IngredientMatchSerializer(data={
+            'ingredients': [
+                value for param in request.query_params.getlist(
+                    'ingredients')
+                for value in param.split(',') if value
+            ],
+            'max_missing': request.query_params.get('max_missing', 0),
+        })
+        serializer.is_valid(raise_exception=True)
+        matches = ingredient_index.match(
+            serializer.validated_data['ingredients'],
+            serializer.validated_data['max_missing'])
+        page = self.paginate_queryset(matches)
+        recipes = Recipe.objects.for_feed(request.user).in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        results = []
+        for recipe_id, matched_count, missing_count in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.matched_count = matched_count
+            recipe.missing_count = missing_count
+            results.append(recipe)
+        serializer = RecipeMatchSerializer(
+            results, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], pagination_class=None)
+    def similar(self, request, **kwargs):
+        try:
+            pk = int(kwargs['pk'])
+        except ValueError:
+            raise Http404
+        rows = list(
+            SimilarRecipe.objects.filter(recipe_id=pk)
+            .select_related('similar')
+            .order_by('-score')
         )
+        if not rows:
+            get_object_or_404(Recipe, id=pk)
+        serializer = RecipeSubcribeSerializer(
+            [row.similar for row in rows], many=True,
+            context={'request': request})
+        return Response(serializer.data)
 
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="shopping_cart.csv"'
-        writer = csv.writer(response)
-        writer.writerow(['Ingredient', 'Amount'])
+    def batch_change(self, request, model, counter):
+        serializer = BatchChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lock_users([request.user.pk])
+        results, added, removed = change_relations(
+            model, request.user, 'recipe',
+            serializer.validated_data['add'],
+            serializer.validated_data['remove'],
+            targets=Recipe.objects.all())
+        shift_counter(Recipe.objects.all(), counter, added, removed)
+        return results, added, removed
 
-        for item in shopping_cart:
-            writer.writerow([item['recipe__recipes__ingredient__name'], item['amount']])
+    @action(detail=False, permission_classes=(IsAuthenticated, ),
+            methods=['post'], url_path='favorite/batch')
+    @transaction.atomic
+    def favorite_batch(self, request):
+        results, _, _ = self.batch_change(request, Favorite,
+                                          'favorites_count')
+        return Response({'results': results})
+
+    @action(detail=False, permission_classes=(IsAuthenticated, ),
+            methods=['post'], url_path='shopping_cart/batch')
+    @transaction.atomic
+    def shopping_cart_batch(self, request):
+        results, added, removed = self.batch_change(
+            request, ShoppingCart, 'in_carts_count')
+        shopping_list.add_recipes(request.user, added)
+        shopping_list.remove_recipes(request.user, removed)
+        return Response({'results': results})
 
-        return response
+    @action(detail=False, permission_classes=(IsAuthenticated, ),
+            methods=['get'], renderer_classes=SHOPPING_LIST_RENDERERS)
+    def download_shopping_cart(self, request, **kwargs):
+        return stream_shopping_list(request.user,
+                                    request.accepted_renderer)
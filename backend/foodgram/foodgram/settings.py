@@ -94,6 +94,13 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT')
     }
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Тесты с параллельными запросами открывают по соединению на поток.
+    # Общая in-memory база SQLite блокирует таблицы без ожидания,
+    # поэтому тестовая база - файл.
+    DATABASES['default']['TEST'] = {
+        'NAME': os.getenv('DB_TEST_NAME', BASE_DIR / 'test_db.sqlite3'),
+    }
 
 
 # Password validation
@@ -121,7 +128,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -133,6 +140,21 @@ REST_FRAMEWORK = {
     'SEARCH_PARAM': 'name',
 }
 
+# Кэш проверки токенов: время жизни записи в секундах, размер LRU
+# и необязательный алиас общего кэша из CACHES.
+TOKEN_AUTH_CACHE = {
+    'TTL': 30,
+    'MAX_SIZE': 10000,
+    'CACHE_ALIAS': os.getenv('TOKEN_AUTH_CACHE_ALIAS'),
+}
+
+# Кэш страниц списка рецептов: время жизни страницы в секундах
+# и алиас кэша из CACHES.
+RECIPE_FEED_CACHE = {
+    'TTL': 60,
+    'CACHE_ALIAS': os.getenv('RECIPE_FEED_CACHE_ALIAS', 'default'),
+}
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
 }
@@ -161,6 +183,21 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузки картинок пишутся во временный файл по частям, а не в память.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Варианты картинок создает process_recipe_images --watch по флагу
+# image_pending. Пул потоков в воркере - необязательное ускорение,
+# задачи в нем теряются при перезапуске и конкурируют с запросами.
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 0))
+
+# Рецепты авторов с большим числом подписчиков не раскладываются
+# по лентам при публикации, а подмешиваются при чтении ленты.
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(
+    os.getenv('TIMELINE_FANOUT_MAX_FOLLOWERS', 10000))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
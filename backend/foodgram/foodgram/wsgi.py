@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+# индекс подбора по продуктам строится в фоне до первых запросов
+from recipes.ingredient_index import ingredient_index  # noqa: E402
+
+ingredient_index.rebuild_in_background()
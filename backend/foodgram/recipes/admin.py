@@ -1,14 +1,18 @@
 from django.contrib import admin
 from .models import (Ingredient, Tag, Recipe, RecipeIngredient, Favorite,
-                     ShoppingCart)
+                     ShoppingCart, ShoppingListItem, RecipeScore,
+                     SimilarRecipe)
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'author', 'in_favorites', 'in_carts_count')
     list_filter = ('author', 'name', 'tags')
+    readonly_fields = ('favorites_count', 'in_carts_count')
 
+    @admin.display(description='В избранном')
     def in_favorites(self, obj):
-        return obj.favorite_recipe.count()
+        return obj.favorites_count
 
 
 @admin.register(Ingredient)
@@ -20,4 +24,7 @@ class IngredientAdmin(admin.ModelAdmin):
 admin.site.register(RecipeIngredient)
 admin.site.register(Favorite)
 admin.site.register(ShoppingCart)
+admin.site.register(ShoppingListItem)
+admin.site.register(RecipeScore)
+admin.site.register(SimilarRecipe)
 admin.site.register(Tag)
@@ -0,0 +1,141 @@
+import time
+from threading import Lock
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CatalogVersion, Ingredient, Tag
+
+
+def read_version(name):
+    """(версия, updated_at) строки CatalogVersion, (0, None) без строки."""
+    return (
+        CatalogVersion.objects.filter(name=name)
+        .values_list('version', 'updated_at').first()
+        or (0, None)
+    )
+
+
+def bump_version(name):
+    """Увеличивает версию name в БД, изменение видно всем процессам."""
+    updated = CatalogVersion.objects.filter(name=name).update(
+        version=F('version') + 1, updated_at=timezone.now())
+    if not updated:
+        CatalogVersion.objects.get_or_create(name=name,
+                                             defaults={'version': 1})
+
+
+class CatalogCache:
+    """Версионированный read-through кэш справочника в памяти процесса.
+
+    Номер версии хранится в таблице CatalogVersion, поэтому изменение
+    из любого процесса, в том числе из management-команды, видно всем
+    воркерам. Версия сверяется одним запросом по первичному ключу
+    не чаще раза в check_interval секунд, изменения из других
+    процессов видны с такой задержкой, из своего - сразу. id, которых
+    нет в снимке, дочитываются из БД. Целиком (all, snapshot)
+    загружаются только небольшие справочники с load_all.
+    """
+    ttl = 300
+    check_interval = 1
+
+    def __init__(self, model, load_all=False):
+        self.model = model
+        self.name = model._meta.model_name
+        self.load_all = load_all
+        self._lock = Lock()
+        self._checked = float('-inf')
+        self._reset(None)
+
+    def _reset(self, version):
+        self._version = version
+        self._updated_at = None
+        self._expires = time.monotonic() + self.ttl
+        self._objects = {}
+        self._all = None
+
+    def _sync(self):
+        now = time.monotonic()
+        if now < self._checked + self.check_interval:
+            return
+        self._checked = now
+        version, updated_at = read_version(self.name)
+        if version != self._version or now >= self._expires:
+            self._reset(version)
+        self._updated_at = updated_at
+
+    def bump_version(self):
+        """Увеличивает версию справочника в БД для HTTP-валидаторов."""
+        bump_version(self.name)
+
+    def invalidate(self):
+        self.bump_version()
+        with self._lock:
+            self._checked = float('-inf')
+            self._reset(None)
+
+    def _load_all(self):
+        if not self.load_all:
+            raise TypeError(
+                f'Справочник {self.name} не загружается целиком')
+        if self._all is None:
+            self._all = list(self.model.objects.all())
+            self._objects.update((obj.pk, obj) for obj in self._all)
+        return self._all
+
+    def _load_many(self, ids):
+        missing = ids - self._objects.keys()
+        if missing:
+            self._objects.update(
+                (obj.pk, obj)
+                for obj in self.model.objects.filter(pk__in=missing))
+        return {pk: self._objects[pk] for pk in ids if pk in self._objects}
+
+    def all(self):
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """(все объекты, версия, updated_at) из одного снимка."""
+        with self._lock:
+            self._sync()
+            return self._load_all(), self._version, self._updated_at
+
+    def version(self):
+        with self._lock:
+            self._sync()
+            return self._version, self._updated_at
+
+    def get_many(self, ids):
+        """{pk: объект} для найденных ids, отсутствующие читаются из БД."""
+        with self._lock:
+            self._sync()
+            return self._load_many(set(ids))
+
+    def get(self, pk):
+        return self.get_versioned(pk)[0]
+
+    def get_versioned(self, pk):
+        """(объект или None, версия, updated_at) из одного снимка."""
+        with self._lock:
+            self._sync()
+            obj = self._load_many({pk}).get(pk)
+            return obj, self._version, self._updated_at
+
+
+def read_versions(names):
+    """{имя: (версия, updated_at)} нескольких строк одним запросом."""
+    versions = {
+        name: (version, updated_at)
+        for name, version, updated_at in CatalogVersion.objects.filter(
+            name__in=names).values_list('name', 'version', 'updated_at')
+    }
+    return {name: versions.get(name, (0, None)) for name in names}
+
+
+def catalog_versions(*catalogs):
+    """{имя справочника: (версия, updated_at)} одним запросом."""
+    return read_versions([catalog.name for catalog in catalogs])
+
+
+ingredient_catalog = CatalogCache(Ingredient)
+tag_catalog = CatalogCache(Tag, load_all=True)
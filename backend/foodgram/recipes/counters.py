@@ -0,0 +1,55 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Subscribe, User
+
+from .models import Favorite, Recipe, ShoppingCart
+
+# (модель, поле-счетчик, модель-источник, внешний ключ источника)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscribe, 'author'),
+)
+
+
+def actual_count(source, field):
+    return Coalesce(
+        Subquery(
+            source.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def drifted(model, counter, source, field):
+    """Объекты, у которых счетчик расходится с фактическим числом строк."""
+    return (
+        model.objects
+        .annotate(actual=actual_count(source, field))
+        .exclude(**{counter: F('actual')})
+    )
+
+
+def reconcile(check=False, batch_size=1000):
+    """Исправляет расхождения счетчиков, возвращает {поле: число}."""
+    report = {}
+    for model, counter, source, field in COUNTERS:
+        ids = list(
+            drifted(model, counter, source, field)
+            .values_list('pk', flat=True)
+        )
+        report[f'{model._meta.model_name}.{counter}'] = len(ids)
+        if check:
+            continue
+        for start in range(0, len(ids), batch_size):
+            model.objects.filter(
+                pk__in=ids[start:start + batch_size]
+            ).update(**{counter: actual_count(source, field)})
+    return report
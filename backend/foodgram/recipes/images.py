@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+ORIGINALS_DIR = 'images'
+VARIANTS_DIR = 'images/variants'
+# имя варианта: максимальный размер стороны (None - исходный размер)
+VARIANTS = {
+    'thumb': 320,
+    'card': 800,
+    'webp': None,
+}
+WEBP_QUALITY = 80
+HASH_CHUNK_SIZE = 64 * 1024
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix='recipe-images')
+    return _executor
+
+
+def file_digest(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def save_once(name, content):
+    """Сохраняет файл под детерминированным именем без дубликатов."""
+    saved = default_storage.save(name, content)
+    if saved != name:
+        # файл с тем же содержимым успел сохранить параллельный запрос
+        default_storage.delete(saved)
+    return name
+
+
+def store_original(file):
+    """Сохраняет загруженный файл под именем по хэшу содержимого.
+
+    Одинаковые картинки хранятся один раз, повторная загрузка
+    возвращает имя уже сохраненного файла.
+    """
+    digest = file_digest(file)
+    extension = os.path.splitext(file.name)[1].lower() or '.jpg'
+    name = f'{ORIGINALS_DIR}/{digest[:2]}/{digest}{extension}'
+    if not default_storage.exists(name):
+        save_once(name, file)
+    return name
+
+
+def variant_name(digest, variant):
+    return f'{VARIANTS_DIR}/{digest[:2]}/{digest}_{variant}.webp'
+
+
+def render_variant(image, size):
+    if size is not None:
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_variants(name):
+    """Создает недостающие варианты картинки, возвращает {вариант: имя}."""
+    with default_storage.open(name, 'rb') as file:
+        digest = file_digest(file)
+        names = {variant: variant_name(digest, variant)
+                 for variant in VARIANTS}
+        missing = [variant for variant, path in names.items()
+                   if not default_storage.exists(path)]
+        if missing:
+            image = ImageOps.exif_transpose(Image.open(file))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            for variant in missing:
+                save_once(names[variant],
+                          render_variant(image, VARIANTS[variant]))
+    return names
+
+
+def build_variants(recipe_id, name):
+    """Создает варианты картинки и снимает рецепт с очереди.
+
+    Запись идет только если у рецепта все еще та же картинка: новая
+    загрузка, пришедшая во время обработки, остается в очереди.
+    """
+    variants = generate_variants(name)
+    return Recipe.objects.filter(pk=recipe_id, image=name).update(
+        image_variants=variants, image_pending=False,
+        updated_at=timezone.now())
+
+
+def process_recipe_image(recipe_id, name):
+    try:
+        build_variants(recipe_id, name)
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+    finally:
+        connections.close_all()
+
+
+def schedule_variants(recipe):
+    """Ускоряет обработку картинки рецепта, уже стоящего в очереди.
+
+    Очередь - флаг image_pending в БД, ее разбирает
+    process_recipe_images --watch, поэтому задача не теряется при
+    перезапуске воркера. Если IMAGE_PROCESSING_WORKERS больше нуля,
+    картинка после коммита еще и отправляется в пул потоков процесса.
+    """
+    if settings.IMAGE_PROCESSING_WORKERS <= 0:
+        return
+    recipe_id, name = recipe.pk, recipe.image.name
+    transaction.on_commit(
+        lambda: get_executor().submit(process_recipe_image, recipe_id, name))
+
+
+def image_url(recipe, variant=None, request=None):
+    name = (recipe.image_variants or {}).get(variant) or recipe.image.name
+    if not name:
+        return None
+    url = default_storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
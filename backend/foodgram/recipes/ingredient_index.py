@@ -0,0 +1,201 @@
+"""Инвертированный индекс ингредиент -> рецепты для подбора по продуктам.
+
+Для каждого ингредиента хранится отсортированный array('q') с id
+рецептов, для каждого рецепта - кортеж его различных ингредиентов.
+Индекс живет в памяти процесса. Он строится в фоне при старте
+воркера (foodgram/wsgi.py) и раз в ttl секунд перестраивается тоже
+в фоне: до подмены запросы обслуживает прежний снимок. Между
+перестройками индекс обновляется по рецептам с изменившимся
+updated_at, когда меняется версия в строке CatalogVersion
+'ingredient-index'. Версия лежит в БД, поэтому запись рецепта в любом
+процессе видна всем воркерам не позже чем через check_interval
+секунд.
+"""
+import bisect
+import logging
+import time
+from array import array
+from collections import Counter
+from datetime import timedelta
+from threading import Lock, Thread
+
+from django.db import connections
+from django.db.models import Max
+
+from .catalog import bump_version, read_version
+from .models import Recipe, RecipeIngredient
+
+logger = logging.getLogger(__name__)
+
+
+class IngredientIndex:
+    # полная перестройка в фоне не реже раза в ttl секунд
+    ttl = 3600
+    # как часто сверять версию с БД
+    check_interval = 1
+    # запас на транзакции, закоммиченные позже своего updated_at
+    sync_margin = timedelta(seconds=60)
+    version_name = 'ingredient-index'
+
+    def __init__(self):
+        # снимок индекса и его версия
+        self._lock = Lock()
+        # одна полная перестройка за раз
+        self._build_lock = Lock()
+        self._postings = None
+        self._recipes = None
+        self._version = None
+        self._watermark = None
+        self._expires = 0
+        self._checked = float('-inf')
+        self._rebuilding = False
+
+    def invalidate(self):
+        bump_version(self.version_name)
+        with self._lock:
+            self._checked = float('-inf')
+
+    def _build(self):
+        """Новый снимок (postings, recipes, версия, watermark) из БД."""
+        version = read_version(self.version_name)[0]
+        watermark = Recipe.objects.aggregate(
+            watermark=Max('updated_at'))['watermark']
+        postings = {}
+        recipes = {}
+        rows = (
+            RecipeIngredient.objects
+            .order_by('ingredient_id', 'recipe_id')
+            .values_list('ingredient_id', 'recipe_id')
+            .distinct()
+            .iterator()
+        )
+        for ingredient_id, recipe_id in rows:
+            posting = postings.get(ingredient_id)
+            if posting is None:
+                posting = postings[ingredient_id] = array('q')
+            posting.append(recipe_id)
+            recipes[recipe_id] = recipes.get(recipe_id, ()) + (
+                ingredient_id,)
+        for recipe_id in Recipe.objects.values_list('pk', flat=True):
+            recipes.setdefault(recipe_id, ())
+        return postings, recipes, version, watermark
+
+    def _swap(self, snapshot):
+        with self._lock:
+            (self._postings, self._recipes,
+             self._version, self._watermark) = snapshot
+            self._expires = time.monotonic() + self.ttl
+            # изменения, закоммиченные во время сборки
+            self._checked = float('-inf')
+
+    def rebuild(self):
+        """Строит индекс заново и подменяет им текущий снимок."""
+        with self._build_lock:
+            self._swap(self._build())
+
+    def _ensure_built(self):
+        """При холодном старте ждет сборку в фоне или строит индекс сам."""
+        if self._postings is not None:
+            return
+        with self._build_lock:
+            if self._postings is None:
+                self._swap(self._build())
+
+    def _rebuild_in_thread(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Не удалось перестроить индекс ингредиентов')
+        finally:
+            self._rebuilding = False
+            connections.close_all()
+
+    def rebuild_in_background(self):
+        """Запускает перестройку в фоновом потоке, если она не идет."""
+        with self._lock:
+            self._start_rebuild()
+
+    def _start_rebuild(self):
+        if self._rebuilding:
+            return
+        self._rebuilding = True
+        Thread(target=self._rebuild_in_thread, name='ingredient-index',
+               daemon=True).start()
+
+    def _remove(self, recipe_id):
+        for ingredient_id in self._recipes.pop(recipe_id, ()):
+            posting = self._postings[ingredient_id]
+            position = bisect.bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                del posting[position]
+
+    def _add(self, recipe_id, ingredient_ids):
+        for ingredient_id in ingredient_ids:
+            posting = self._postings.setdefault(ingredient_id, array('q'))
+            bisect.insort(posting, recipe_id)
+        self._recipes[recipe_id] = ingredient_ids
+
+    def _apply_changes(self, version):
+        changed = {}
+        watermark = self._watermark
+        if watermark is None:
+            recipes = Recipe.objects.all()
+        else:
+            recipes = Recipe.objects.filter(
+                updated_at__gte=watermark - self.sync_margin)
+        for recipe_id, updated_at in recipes.values_list('pk', 'updated_at'):
+            changed[recipe_id] = set()
+            watermark = max(watermark or updated_at, updated_at)
+        rows = RecipeIngredient.objects.filter(
+            recipe_id__in=list(changed)
+        ).values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows:
+            changed[recipe_id].add(ingredient_id)
+        for recipe_id, ingredient_ids in changed.items():
+            ingredient_ids = tuple(sorted(ingredient_ids))
+            if self._recipes.get(recipe_id) != ingredient_ids:
+                self._remove(recipe_id)
+                self._add(recipe_id, ingredient_ids)
+        if Recipe.objects.count() != len(self._recipes):
+            existing = set(Recipe.objects.values_list('pk', flat=True))
+            for recipe_id in self._recipes.keys() - existing:
+                self._remove(recipe_id)
+        self._version = version
+        self._watermark = watermark
+
+    def _sync(self):
+        now = time.monotonic()
+        if now >= self._expires:
+            # повторный запуск - не раньше следующего ttl
+            self._expires = now + self.ttl
+            self._start_rebuild()
+        if now < self._checked + self.check_interval:
+            return
+        self._checked = now
+        version = read_version(self.version_name)[0]
+        if version != self._version:
+            self._apply_changes(version)
+
+    def match(self, ingredient_ids, max_missing=0):
+        """Рецепты, которым не хватает не больше max_missing ингредиентов.
+
+        Возвращает список (recipe_id, совпало, не хватает),
+        отсортированный по числу недостающих, затем по числу
+        совпавших ингредиентов и по новизне рецепта.
+        """
+        self._ensure_built()
+        with self._lock:
+            self._sync()
+            covered = Counter()
+            for ingredient_id in set(ingredient_ids):
+                covered.update(self._postings.get(ingredient_id, ()))
+            matches = []
+            for recipe_id, count in covered.items():
+                missing = len(self._recipes.get(recipe_id, ())) - count
+                if missing <= max_missing:
+                    matches.append((recipe_id, count, missing))
+        matches.sort(key=lambda item: (item[2], -item[1], -item[0]))
+        return matches
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import timeline
+
+
+class Command(BaseCommand):
+    help = "Заполнение лент подписок по текущим подпискам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='Заполнить ленту только этого пользователя (id)')
+        parser.add_argument(
+            '--per-author', type=int, default=timeline.BACKFILL_PER_AUTHOR,
+            help='Сколько последних рецептов автора добавить в ленту')
+        parser.add_argument(
+            '--batch-size', type=int, default=timeline.BATCH_SIZE,
+            help='Количество записей в одной пачке вставки')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = timeline.backfill(user_ids=options['users'],
+                                      per_author=options['per_author'],
+                                      batch_size=options['batch_size'])
+        self.stdout.write(f'Ленты заполнены по {total} авторам')
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.scores import rebuild_scores
+
+
+class Command(BaseCommand):
+    help = "Пересчет рейтингов рецептов для сортировок popular и trending"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--window-days', type=float, default=7,
+            help='Окно учета событий для trending, в днях')
+        parser.add_argument(
+            '--half-life-hours', type=float, default=24,
+            help='Период полураспада веса события, в часах')
+        parser.add_argument(
+            '--cart-weight', type=float, default=0.5,
+            help='Вес добавления в корзину относительно избранного')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = rebuild_scores(
+                window=timedelta(days=options['window_days']),
+                half_life=timedelta(hours=options['half_life_hours']),
+                cart_weight=options['cart_weight'],
+            )
+        self.stdout.write(f'Рейтинги пересчитаны для {total} рецептов')
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import Recipe
+from recipes.similarity import TOP_K, rebuild_similar
+
+
+class Command(BaseCommand):
+    help = "Пересчет похожих рецептов по общим ингредиентам и тэгам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=TOP_K,
+            help='Сколько похожих рецептов хранить для каждого рецепта')
+        parser.add_argument(
+            '--changed-since-hours', type=float,
+            help='Пересчитать только рецепты, измененные за последние '
+                 'часы, и рецепты, на которые это повлияло')
+
+    def handle(self, *args, **options):
+        changed_ids = None
+        if options['changed_since_hours'] is not None:
+            since = timezone.now() - timedelta(
+                hours=options['changed_since_hours'])
+            changed_ids = list(
+                Recipe.objects.filter(updated_at__gte=since)
+                .values_list('pk', flat=True))
+        with transaction.atomic():
+            total = rebuild_similar(k=options['top_k'],
+                                    changed_ids=changed_ids)
+        self.stdout.write(f'Похожие рецепты пересчитаны для {total} рецептов')
@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_variants
+from recipes.models import Recipe
+
+BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = ("Создание миниатюр и webp-вариантов картинок рецептов "
+            "из очереди image_pending")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Обработать все рецепты с картинкой, а не только очередь')
+        parser.add_argument(
+            '--watch', action='store_true',
+            help='Не завершаться, а разбирать очередь по мере пополнения')
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Пауза между проверками очереди в режиме --watch, секунд')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            processed = self.process(Recipe.objects.exclude(image=''))
+        else:
+            processed = self.process_queue()
+        self.stdout.write(f'Обработано картинок: {processed}')
+        while options['watch']:
+            processed = self.process_queue()
+            if processed:
+                self.stdout.write(f'Обработано картинок: {processed}')
+            else:
+                time.sleep(options['interval'])
+
+    def process_queue(self):
+        processed = 0
+        while True:
+            batch = Recipe.objects.filter(image_pending=True).order_by(
+                'pk')[:BATCH_SIZE]
+            count = self.process(batch)
+            processed += count
+            if count < BATCH_SIZE:
+                return processed
+
+    def process(self, recipes):
+        processed = 0
+        for recipe in recipes.only('id', 'image').iterator():
+            name = recipe.image.name
+            try:
+                build_variants(recipe.pk, name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{name}: {error}')
+                # битая картинка не должна стоять в очереди вечно
+                Recipe.objects.filter(pk=recipe.pk, image=name).update(
+                    image_pending=False)
+            processed += 1
+        return processed
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import search
+
+
+class Command(BaseCommand):
+    help = "Пересборка полнотекстового индекса рецептов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=search.BATCH_SIZE,
+            help='Количество рецептов в одной пачке обновления')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = search.rebuild_index(options['batch_size'])
+        self.stdout.write(f'Проиндексировано рецептов: {total}')
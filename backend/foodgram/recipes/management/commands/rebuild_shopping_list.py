@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import shopping_list
+
+
+class Command(BaseCommand):
+    help = "Пересборка и проверка материализованного списка покупок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить расхождения, не изменяя данные')
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='Ограничить пользователями с указанным id')
+
+    def handle(self, *args, **options):
+        user_ids = options['users']
+        drift = shopping_list.find_drift(user_ids)
+        for (user_id, ingredient_id), (stored, expected) in sorted(
+                drift.items()):
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'хранится {stored}, ожидается {expected}')
+        if options['check']:
+            if drift:
+                self.stderr.write(f'Найдено расхождений: {len(drift)}')
+                raise SystemExit(1)
+            self.stdout.write('Расхождений не найдено')
+            return
+        with transaction.atomic():
+            shopping_list.rebuild(user_ids)
+        self.stdout.write(
+            f'Список покупок пересобран, исправлено позиций: {len(drift)}')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import counters
+
+
+class Command(BaseCommand):
+    help = "Сверка и исправление счетчиков избранного, корзин и подписок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить расхождения, не изменяя данные')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            report = counters.reconcile(check=options['check'])
+        for counter, total in report.items():
+            self.stdout.write(f'{counter}: расхождений {total}')
+        if options['check'] and any(report.values()):
+            raise SystemExit(1)
@@ -1,31 +1,161 @@
 import csv
+import json
 import os
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
 from foodgram import settings
-from django.core.management.base import BaseCommand
-from progress.bar import IncrementalBar
+from recipes.catalog import ingredient_catalog
 from recipes.models import Ingredient
 
+READ_CHUNK_SIZE = 64 * 1024
+HEADER = ('name', 'measurement_unit')
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) < 2:
+            continue
+        yield row[0], row[1]
+
+
+def iter_json_objects(file):
+    """Потоково читает JSON-массив объектов или JSON Lines."""
+    decoder = json.JSONDecoder()
+    separators = ' \t\r\n[,'
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in separators:
+            position += 1
+        if position < len(buffer):
+            if buffer[position] == ']':
+                return
+            try:
+                obj, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield obj
+                continue
+        elif eof:
+            return
+        chunk = file.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def read_json(file):
+    for obj in iter_json_objects(file):
+        yield obj['name'], obj['measurement_unit']
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
 
-def ingredient_create(row):
-    Ingredient.objects.get_or_create(
-        name=row[0],
-        measurement_unit=row[1]
+
+def unique_rows(rows):
+    seen = set()
+    for name, measurement_unit in rows:
+        key = (name.strip(), measurement_unit.strip())
+        if not all(key) or key == HEADER or key in seen:
+            continue
+        seen.add(key)
+        yield key
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def existing_keys(chunk):
+    return set(
+        Ingredient.objects.filter(name__in={name for name, _ in chunk})
+        .values_list('name', 'measurement_unit')
     )
 
 
 class Command(BaseCommand):
-    help = "Загрузка данных из csv файла"
+    help = "Загрузка ингредиентов из csv или json файла"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=os.path.join(settings.BASE_DIR, 'ingredients.csv'),
+            help='Путь к файлу или "-" для чтения из stdin')
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Формат данных, по умолчанию определяется по расширению')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество строк в одной пачке вставки')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Показать, какие ингредиенты будут добавлены, без записи')
+
+    def get_format(self, path, data_format):
+        if data_format:
+            return data_format
+        extension = os.path.splitext(path)[1].lstrip('.').lower()
+        if extension in READERS:
+            return extension
+        if path == '-':
+            return 'csv'
+        raise CommandError(f'Не удалось определить формат файла {path}')
 
     def handle(self, *args, **options):
-        path = os.path.join(settings.BASE_DIR, 'ingredients.csv')
+        path = options['path']
+        reader = READERS[self.get_format(path, options['format'])]
+        if path == '-':
+            self.load(reader(sys.stdin), options)
+            return
         with open(path, 'r', encoding='utf-8') as file:
-            row_count = sum(1 for row in file)
-        with open(path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            bar = IncrementalBar('ingredients.csv'.ljust(17), max=row_count)
-            next(reader)
-            for row in reader:
-                bar.next()
-                ingredient_create(row)
-            bar.finish()
-        self.stdout.write("Ингредиенты загружены в базу данных")
+            self.load(reader(file), options)
+
+    def load(self, rows, options):
+        dry_run = options['dry_run']
+        verbose = options['verbosity'] > 1
+        started = time.monotonic()
+        before = Ingredient.objects.count()
+        total = new = 0
+        for chunk in chunked(unique_rows(rows), options['batch_size']):
+            total += len(chunk)
+            if dry_run:
+                existing = existing_keys(chunk)
+                for name, measurement_unit in chunk:
+                    if (name, measurement_unit) not in existing:
+                        new += 1
+                        if verbose:
+                            self.stdout.write(f'+ {name}, {measurement_unit}')
+                continue
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=measurement_unit)
+                 for name, measurement_unit in chunk],
+                ignore_conflicts=True,
+            )
+            if verbose:
+                self.stdout.write(f'Обработано строк: {total}')
+        elapsed = max(time.monotonic() - started, 1e-6)
+        if dry_run:
+            self.stdout.write(
+                f'Уникальных строк: {total}, будет добавлено: {new}, '
+                f'уже в базе: {total - new}')
+            return
+        added = Ingredient.objects.count() - before
+        if added:
+            ingredient_catalog.invalidate()
+        self.stdout.write(
+            f'Ингредиенты загружены в базу данных: строк {total}, '
+            f'добавлено {added}, {total / elapsed:.0f} строк/с')
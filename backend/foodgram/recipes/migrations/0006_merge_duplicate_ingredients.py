@@ -0,0 +1,49 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:17
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = (
+        Ingredient.objects
+        .values('name', 'measurement_unit')
+        .annotate(keep_id=models.Min('id'), total=models.Count('id'))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    for group in duplicates:
+        keep_id = group['keep_id']
+        extra_ids = list(
+            Ingredient.objects
+            .filter(name=group['name'],
+                    measurement_unit=group['measurement_unit'])
+            .exclude(id=keep_id)
+            .values_list('id', flat=True)
+        )
+        RecipeIngredient.objects.filter(
+            ingredient_id__in=extra_ids).update(ingredient_id=keep_id)
+        for item in ShoppingListItem.objects.filter(
+                ingredient_id__in=extra_ids):
+            kept, created = ShoppingListItem.objects.get_or_create(
+                user_id=item.user_id, ingredient_id=keep_id,
+                defaults={'amount': item.amount})
+            if not created:
+                kept.amount += item.amount
+                kept.save(update_fields=['amount'])
+            item.delete()
+        Ingredient.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_ingredient_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+    ]
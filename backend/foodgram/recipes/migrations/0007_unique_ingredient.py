@@ -0,0 +1,20 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:17
+
+from django.db import migrations, models
+
+
+# ограничение добавляется отдельной миграцией: в одной транзакции
+# с обновлением строк PostgreSQL отказывается менять таблицу
+# ("pending trigger events")
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_merge_duplicate_ingredients'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
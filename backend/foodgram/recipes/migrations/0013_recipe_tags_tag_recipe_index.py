@@ -0,0 +1,21 @@
+from django.db import migrations
+
+# Автоматическая M2M-таблица не имеет Meta, поэтому индекс
+# (tag_id, recipe_id) для фильтра по тэгам создается вручную.
+# Уникальный индекс (recipe_id, tag_id) уже создан Django.
+CREATE_INDEX = (
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_tags_tag_recipe_idx '
+    'ON recipes_recipe_tags (tag_id, recipe_id)'
+)
+DROP_INDEX = 'DROP INDEX IF EXISTS recipes_recipe_tags_tag_recipe_idx'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_updated_at_catalogversion'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+    ]
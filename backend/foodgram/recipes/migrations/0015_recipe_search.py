@@ -0,0 +1,64 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:30
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+INGREDIENT_NAMES = (
+    "(SELECT {aggregate} FROM recipes_recipeingredient ri "
+    "JOIN recipes_ingredient i ON i.id = ri.ingredient_id "
+    "WHERE ri.recipe_id = r.id)"
+)
+POSTGRES_FORWARD = (
+    'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+    "UPDATE recipes_recipe r SET search_vector = "
+    "setweight(to_tsvector('russian'::regconfig, "
+    "COALESCE(r.name, '')), 'A') || "
+    "setweight(to_tsvector('russian'::regconfig, COALESCE("
+    + INGREDIENT_NAMES.format(aggregate="string_agg(i.name, ' ')")
+    + ", '')), 'B') || "
+    "setweight(to_tsvector('russian'::regconfig, "
+    "COALESCE(r.text, '')), 'C')",
+)
+POSTGRES_BACKWARD = (
+    'DROP INDEX IF EXISTS recipe_search_vector_idx',
+)
+SQLITE_FORWARD = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts USING fts5('
+    "name, text, ingredients, tokenize = 'unicode61 remove_diacritics 2')",
+    'INSERT INTO recipes_recipe_fts (rowid, name, text, ingredients) '
+    "SELECT r.id, r.name, r.text, COALESCE("
+    + INGREDIENT_NAMES.format(aggregate="group_concat(i.name, ' ')")
+    + ", '') FROM recipes_recipe r",
+)
+SQLITE_BACKWARD = (
+    'DROP TABLE IF EXISTS recipes_recipe_fts',
+)
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            run_for_vendor({'postgresql': POSTGRES_FORWARD,
+                            'sqlite': SQLITE_FORWARD}),
+            run_for_vendor({'postgresql': POSTGRES_BACKWARD,
+                            'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
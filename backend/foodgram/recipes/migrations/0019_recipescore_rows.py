@@ -0,0 +1,27 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:40
+
+from django.db import migrations
+
+
+def create_scores(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeScore = apps.get_model('recipes', 'RecipeScore')
+    recipe_ids = list(
+        Recipe.objects.filter(score__isnull=True)
+        .values_list('pk', flat=True)
+    )
+    RecipeScore.objects.bulk_create(
+        [RecipeScore(recipe_id=recipe_id) for recipe_id in recipe_ids],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_timelineentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_scores, migrations.RunPython.noop),
+    ]
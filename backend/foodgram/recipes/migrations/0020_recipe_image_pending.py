@@ -0,0 +1,38 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:19
+
+from django.db import migrations, models
+
+VARIANTS = {'thumb', 'card', 'webp'}
+
+
+def queue_unprocessed(apps, schema_editor):
+    """Ставит в очередь картинки, у которых нет всех вариантов."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    pending = [
+        pk for pk, variants in Recipe.objects.exclude(image='')
+        .values_list('pk', 'image_variants').iterator()
+        if not VARIANTS <= set(variants or ())
+    ]
+    for start in range(0, len(pending), 1000):
+        Recipe.objects.filter(pk__in=pending[start:start + 1000]).update(
+            image_pending=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_recipescore_rows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_pending',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Ждет обработки'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('image_pending', True)), fields=['id'], name='recipe_image_pending_idx'),
+        ),
+        migrations.RunPython(queue_unprocessed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+# В SQLite 0007_unique_ingredient пересоздала таблицу ингредиентов,
+# и индекс из 0005_ingredient_name_search_indexes пропал вместе с ней.
+SQLITE_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_prefix '
+    'ON recipes_ingredient (name COLLATE NOCASE)',
+)
+SQLITE_DROP = (
+    'DROP INDEX IF EXISTS recipes_ingredient_name_prefix',
+)
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0020_recipe_image_pending'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_INDEXES}),
+            run_for_vendor({'sqlite': SQLITE_DROP}),
+        ),
+    ]
@@ -1,4 +1,9 @@
+import uuid
+
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import (Exists, OuterRef, Prefetch, Q, Value,
+                              BooleanField)
 from users.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
@@ -34,11 +39,43 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингридиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """Аннотирует is_favorited и is_in_shopping_cart подзапросами."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()))
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))))
+
+    def for_feed(self, user):
+        """Лента рецептов с постоянным числом запросов на страницу."""
+        return self.with_user_flags(user).prefetch_related(
+            Prefetch('author',
+                     queryset=User.objects.with_subscription(user)),
+            'tags',
+            Prefetch('recipes',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')),
+        )
+
+
 class Recipe(models.Model):
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -49,6 +86,14 @@ class Recipe(models.Model):
                                   verbose_name='Тэги')
     image = models.ImageField(verbose_name='Картинка',
                               upload_to='images/')
+    image_variants = models.JSONField(default=dict,
+                                      blank=True,
+                                      editable=False,
+                                      verbose_name='Варианты картинки')
+    # очередь process_recipe_images: варианты картинки еще не созданы
+    image_pending = models.BooleanField(default=False,
+                                        editable=False,
+                                        verbose_name='Ждет обработки')
     name = models.CharField(max_length=200,
                             verbose_name='Название')
     text = models.TextField(verbose_name='Текст')
@@ -62,11 +107,32 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Дата изменения'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0, verbose_name='В избранном')
+    in_carts_count = models.PositiveIntegerField(
+        default=0, verbose_name='В корзинах')
+    # заполняется recipes.search, используется только в PostgreSQL
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_feed_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_feed_idx'),
+            models.Index(fields=['id'], condition=Q(image_pending=True),
+                         name='recipe_image_pending_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -106,6 +172,11 @@ class Favorite(models.Model):
         related_name='favorite_recipe',
         verbose_name='Избранный рецепт'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления'
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -134,6 +205,11 @@ class ShoppingCart(models.Model):
         related_name='shopping_recipe',
         verbose_name='Рецепт в корзине'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Дата добавления'
+    )
 
     class Meta:
         verbose_name = 'Корзина'
@@ -147,3 +223,171 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user}, {self.recipe.name}'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}, {self.ingredient}, {self.amount}'
+
+
+class RecipeScore(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт'
+    )
+    popular = models.PositiveIntegerField(
+        default=0, verbose_name='Популярность')
+    trending = models.FloatField(
+        default=0, verbose_name='Тренд')
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name='Дата расчета')
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = [
+            models.Index(fields=['-popular', '-recipe'],
+                         name='recipe_score_popular_idx'),
+            models.Index(fields=['-trending', '-recipe'],
+                         name='recipe_score_trending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}, {self.popular}, {self.trending:.2f}'
+
+
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['recipe', '-score'],
+                         name='similar_recipe_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}, {self.similar}, {self.score:.3f}'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='timeline_user_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user}, {self.recipe_id}'
+
+
+class UploadedImage(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='uploaded_images',
+        verbose_name='Загрузил'
+    )
+    image = models.ImageField(verbose_name='Картинка',
+                              upload_to='images/')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Дата загрузки')
+
+    class Meta:
+        verbose_name = 'Загруженная картинка'
+        verbose_name_plural = 'Загруженные картинки'
+
+    def __str__(self):
+        return f'{self.user}, {self.image.name}'
+
+
+class CatalogVersion(models.Model):
+    name = models.CharField(max_length=50, primary_key=True,
+                            verbose_name='Справочник')
+    version = models.PositiveBigIntegerField(default=0,
+                                             verbose_name='Версия')
+    updated_at = models.DateTimeField(auto_now=True,
+                                      verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return f'{self.name}, {self.version}'
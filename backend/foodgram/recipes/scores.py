@@ -0,0 +1,73 @@
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Favorite, Recipe, RecipeScore, ShoppingCart
+
+
+def popular_scores():
+    """Число добавлений в избранное за все время: {recipe_id: score}."""
+    return dict(
+        Favorite.objects.values('recipe')
+        .annotate(total=Count('pk'))
+        .order_by()
+        .values_list('recipe', 'total')
+    )
+
+
+def trending_scores(window, half_life, cart_weight, now=None):
+    """Избранное и корзины за окно window с экспоненциальным затуханием.
+
+    События группируются по часам в БД, затухание считается в Python
+    по часовым корзинам, поэтому объем данных ограничен числом
+    рецептов, умноженным на число часов в окне.
+    """
+    now = now or timezone.now()
+    scores = defaultdict(float)
+    sources = ((Favorite, 1.0), (ShoppingCart, cart_weight))
+    for model, weight in sources:
+        rows = (
+            model.objects.filter(created__gte=now - window)
+            .annotate(hour=TruncHour('created'))
+            .values('recipe', 'hour')
+            .annotate(total=Count('pk'))
+            .order_by()
+            .values_list('recipe', 'hour', 'total')
+        )
+        for recipe_id, hour, total in rows.iterator():
+            age = max((now - hour).total_seconds(), 0)
+            scores[recipe_id] += (weight * total
+                                  * 0.5 ** (age / half_life.total_seconds()))
+    return scores
+
+
+def rebuild_scores(window=timedelta(days=7), half_life=timedelta(days=1),
+                   cart_weight=0.5, batch_size=1000):
+    """Пересчитывает рейтинги всех рецептов, возвращает их число.
+
+    Строка RecipeScore нужна каждому рецепту, в том числе без
+    событий: сортировки popular и trending идут через INNER JOIN.
+    """
+    popular = popular_scores()
+    trending = trending_scores(window, half_life, cart_weight)
+    RecipeScore.objects.all().delete()
+    recipe_ids = Recipe.objects.values_list('pk', flat=True).iterator()
+    total = 0
+    while True:
+        batch = list(islice(recipe_ids, batch_size))
+        if not batch:
+            return total
+        RecipeScore.objects.bulk_create(
+            [
+                RecipeScore(recipe_id=recipe_id,
+                            popular=popular.get(recipe_id, 0),
+                            trending=trending.get(recipe_id, 0.0))
+                for recipe_id in batch
+            ],
+            ignore_conflicts=True,
+        )
+        total += len(batch)
@@ -0,0 +1,142 @@
+"""Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+
+В PostgreSQL документ хранится в Recipe.search_vector (tsvector с GIN
+индексом), в SQLite - в виртуальной таблице FTS5 recipes_recipe_fts.
+Индекс обновляется после сохранения рецепта (см. signals), полностью
+пересобирается командой rebuild_search_index. В остальных СУБД поиск
+работает через icontains без индекса.
+"""
+import re
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connections
+from django.db.models import (Case, Exists, F, FloatField, OuterRef, Q,
+                              Subquery, Value, When)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+from .models import Recipe, RecipeIngredient
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# веса колонок FTS5 для bm25: name, text, ingredients
+FTS_WEIGHTS = (10.0, 1.0, 5.0)
+BATCH_SIZE = 500
+
+SQLITE_DELETE = f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({{}})'
+SQLITE_INSERT = (
+    f'INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) '
+    "SELECT r.id, r.name, r.text, COALESCE(("
+    "SELECT group_concat(i.name, ' ') FROM recipes_recipeingredient ri "
+    "JOIN recipes_ingredient i ON i.id = ri.ingredient_id "
+    "WHERE ri.recipe_id = r.id), '') "
+    'FROM recipes_recipe r WHERE r.id IN ({})'
+)
+
+
+def vendor(using='default'):
+    return connections[using].vendor
+
+
+def search_document():
+    ingredient_names = Subquery(
+        RecipeIngredient.objects.filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', ' '))
+        .values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(ingredient_names, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_index(recipe_ids):
+    """Пересчитывает поисковый документ рецептов recipe_ids."""
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        if vendor() == 'postgresql':
+            Recipe.objects.filter(pk__in=batch).update(
+                search_vector=search_document())
+        elif vendor() == 'sqlite':
+            placeholders = ', '.join(['%s'] * len(batch))
+            with connections['default'].cursor() as cursor:
+                cursor.execute(SQLITE_DELETE.format(placeholders), batch)
+                cursor.execute(SQLITE_INSERT.format(placeholders), batch)
+
+
+def remove_from_index(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if vendor() != 'sqlite' or not recipe_ids:
+        return
+    with connections['default'].cursor() as cursor:
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            batch = recipe_ids[start:start + BATCH_SIZE]
+            cursor.execute(
+                SQLITE_DELETE.format(', '.join(['%s'] * len(batch))), batch)
+
+
+def rebuild_index(batch_size=BATCH_SIZE):
+    """Пересобирает индекс всех рецептов, возвращает их число."""
+    if vendor() == 'sqlite':
+        with connections['default'].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    total = 0
+    batch = []
+    for pk in Recipe.objects.order_by('pk').values_list(
+            'pk', flat=True).iterator(chunk_size=batch_size):
+        batch.append(pk)
+        if len(batch) == batch_size:
+            update_index(batch)
+            total += len(batch)
+            batch = []
+    update_index(batch)
+    return total + len(batch)
+
+
+def fts_query(term):
+    """Запрос FTS5: все слова с поиском по префиксу, без операторов."""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', term))
+
+
+def search(queryset, term):
+    """Рецепты, подходящие под term, с аннотацией search_rank."""
+    engine = vendor(queryset.db)
+    if engine == 'postgresql':
+        query = SearchQuery(term, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        # ts_rank возвращает real, double precision точно переносится
+        # в позицию курсора и обратно
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=Cast(SearchRank(F('search_vector'), query),
+                             FloatField())
+        ).order_by('-search_rank', '-id')
+    if engine == 'sqlite':
+        match = fts_query(term)
+        if not match:
+            return queryset.none()
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,),
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = {Recipe._meta.db_table}.id',
+            (match,), output_field=FloatField(),
+        )).order_by('-search_rank', '-id')
+    return queryset.filter(
+        Q(name__icontains=term)
+        | Q(text__icontains=term)
+        | Exists(RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk'), ingredient__name__icontains=term))
+    ).annotate(search_rank=Case(
+        When(name__icontains=term, then=Value(1.0)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )).order_by('-search_rank', '-id')
@@ -0,0 +1,162 @@
+"""Инкрементальное обслуживание материализованного списка покупок.
+
+ShoppingListItem хранит готовую сумму ингредиентов по всем рецептам
+в корзине пользователя. Функции модуля применяют к нему дельты при
+изменении корзины или состава рецепта и должны вызываться внутри
+транзакции. Списки чужих пользователей меняются только под
+блокировкой их строк User, той же, что берут изменения корзины.
+"""
+from collections import Counter
+
+from django.db.models import Sum
+
+from users.models import User
+
+from .models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+def recipe_amounts(recipe):
+    """Количество каждого ингредиента рецепта: {ingredient_id: amount}."""
+    return recipes_amounts([recipe.pk])
+
+
+def recipes_amounts(recipe_ids):
+    """Суммарное количество ингредиентов нескольких рецептов."""
+    amounts = Counter()
+    for ingredient_id, amount in (
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+        .values_list('ingredient_id', 'amount')
+    ):
+        amounts[ingredient_id] += amount
+    return amounts
+
+
+def apply_deltas(user_ids, deltas):
+    """Прибавляет deltas к спискам покупок пользователей user_ids."""
+    deltas = {key: value for key, value in deltas.items() if value}
+    user_ids = list(user_ids)
+    if not deltas or not user_ids:
+        return
+    existing = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingListItem.objects.select_for_update().filter(
+            user_id__in=user_ids, ingredient_id__in=deltas)
+    }
+    to_create, to_update, to_delete = [], [], []
+    for user_id in user_ids:
+        for ingredient_id, delta in deltas.items():
+            item = existing.get((user_id, ingredient_id))
+            if item is None:
+                if delta > 0:
+                    to_create.append(ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=delta))
+                continue
+            item.amount += delta
+            if item.amount > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.pk)
+    ShoppingListItem.objects.bulk_create(to_create)
+    ShoppingListItem.objects.bulk_update(to_update, ['amount'])
+    ShoppingListItem.objects.filter(pk__in=to_delete).delete()
+
+
+def add_recipe(user, recipe):
+    apply_deltas([user.pk], recipe_amounts(recipe))
+
+
+def remove_recipe(user, recipe):
+    amounts = recipe_amounts(recipe)
+    apply_deltas([user.pk], {key: -value for key, value in amounts.items()})
+
+
+def add_recipes(user, recipe_ids):
+    if recipe_ids:
+        apply_deltas([user.pk], recipes_amounts(recipe_ids))
+
+
+def remove_recipes(user, recipe_ids):
+    if recipe_ids:
+        amounts = recipes_amounts(recipe_ids)
+        apply_deltas([user.pk],
+                     {key: -value for key, value in amounts.items()})
+
+
+def recipe_users(recipe):
+    """Блокирует владельцев корзин с рецептом, возвращает их id."""
+    return User.objects.filter(
+        pk__in=ShoppingCart.objects.filter(recipe=recipe).values('user_id')
+    ).lock()
+
+
+def update_recipe(recipe, old_amounts, new_amounts):
+    """Переносит изменение состава рецепта на списки всех его владельцев."""
+    deltas = Counter(new_amounts)
+    deltas.subtract(old_amounts)
+    apply_deltas(recipe_users(recipe), deltas)
+
+
+def delete_recipe(recipe):
+    """Вычитает рецепт из списков покупок перед его удалением."""
+    amounts = recipe_amounts(recipe)
+    apply_deltas(recipe_users(recipe),
+                 {key: -value for key, value in amounts.items()})
+
+
+def expected_items(user_ids=None):
+    """Эталонные суммы, посчитанные напрямую по корзинам."""
+    queryset = ShoppingCart.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    rows = (
+        queryset
+        .filter(recipe__recipes__isnull=False)
+        .values('user_id', 'recipe__recipes__ingredient_id')
+        .annotate(amount=Sum('recipe__recipes__amount'))
+        .order_by()
+    )
+    return {
+        (row['user_id'], row['recipe__recipes__ingredient_id']): row['amount']
+        for row in rows
+    }
+
+
+def stored_items(user_ids=None):
+    queryset = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in queryset.values_list(
+            'user_id', 'ingredient_id', 'amount')
+    }
+
+
+def find_drift(user_ids=None):
+    """Пары (user_id, ingredient_id), где хранимая сумма расходится."""
+    expected = expected_items(user_ids)
+    stored = stored_items(user_ids)
+    return {
+        key: (stored.get(key), expected.get(key))
+        for key in expected.keys() | stored.keys()
+        if stored.get(key) != expected.get(key)
+    }
+
+
+def rebuild(user_ids=None):
+    """Полностью пересобирает списки покупок из корзин."""
+    queryset = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    queryset.delete()
+    ShoppingListItem.objects.bulk_create(
+        [
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             amount=amount)
+            for (user_id, ingredient_id), amount
+            in expected_items(user_ids).items()
+        ],
+        batch_size=1000,
+    )
@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search, timeline
+from .catalog import ingredient_catalog, tag_catalog
+from .ingredient_index import ingredient_index
+from .models import Ingredient, Recipe, RecipeIngredient, RecipeScore, Tag
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_catalog(**kwargs):
+    transaction.on_commit(ingredient_catalog.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tag_catalog(**kwargs):
+    transaction.on_commit(tag_catalog.invalidate)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(instance, **kwargs):
+    transaction.on_commit(lambda: search.update_index([instance.pk]))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_search(instance, **kwargs):
+    transaction.on_commit(lambda: search.remove_from_index([instance.pk]))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search(instance, created, **kwargs):
+    if created:
+        return
+    recipe_ids = list(
+        RecipeIngredient.objects.filter(ingredient=instance)
+        .values_list('recipe_id', flat=True).distinct())
+    if recipe_ids:
+        transaction.on_commit(lambda: search.update_index(recipe_ids))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_ingredient_index(**kwargs):
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: timeline.fan_out(instance))
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(instance, created, **kwargs):
+    if created:
+        RecipeScore.objects.create(recipe=instance)
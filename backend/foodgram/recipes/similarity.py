@@ -0,0 +1,257 @@
+"""Похожие рецепты по общим ингредиентам и тэгам.
+
+Рецепт - бинарный вектор признаков (ингредиенты и тэги) с весами idf,
+у тэгов вес снижен. Косинусная мера двух рецептов - сумма квадратов
+весов общих признаков, деленная на произведение норм векторов.
+
+Кандидаты в соседи берутся из инвертированного индекса по всем
+признакам, в том числе по тэгам: от редких к частым, пока их меньше
+ENOUGH_CANDIDATES. Список рецептов признака ограничен
+CANDIDATES_PER_FEATURE самыми новыми рецептами, поэтому соль или
+популярный тэг не превращают расчет в перебор всех пар: на рецепт
+приходится не больше ENOUGH_CANDIDATES + CANDIDATES_PER_FEATURE
+кандидатов. Сходство с кандидатом считается точно, по пересечению
+множеств признаков.
+
+FeatureStore читает из БД только то, что нужно: частоты признаков
+одним агрегатом, признаки и списки рецептов - для пересчитываемых
+рецептов и их кандидатов. Полный пересчет загружает все сразу.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.db.models import Count, Min
+
+from .models import Recipe, RecipeIngredient, SimilarRecipe
+
+TOP_K = 10
+TAG_WEIGHT = 0.5
+CANDIDATES_PER_FEATURE = 500
+# признаки перебираются от редких к частым, пока кандидатов меньше
+ENOUGH_CANDIDATES = 200
+CHUNK_SIZE = 1000
+
+
+def chunks(ids, size=CHUNK_SIZE):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+class FeatureStore:
+    """Признаки рецептов и ограниченные списки рецептов признаков.
+
+    Признак - ('i', id ингредиента) или ('t', id тэга).
+    """
+
+    def __init__(self, cap=CANDIDATES_PER_FEATURE):
+        self.cap = cap
+        total = Recipe.objects.count()
+        self.frequency = {}
+        for ingredient_id, count in (
+            RecipeIngredient.objects.order_by().values('ingredient_id')
+            .annotate(count=Count('recipe_id', distinct=True))
+            .values_list('ingredient_id', 'count')
+        ):
+            self.frequency['i', ingredient_id] = count
+        for tag_id, count in (
+            Recipe.tags.through.objects.order_by().values('tag_id')
+            .annotate(count=Count('recipe_id'))
+            .values_list('tag_id', 'count')
+        ):
+            self.frequency['t', tag_id] = count
+        # квадрат веса признака: слагаемое скалярного произведения.
+        # Признак, появившийся после подсчета частот, не учитывается
+        # до следующего пересчета
+        self.square = {}
+        for feature, count in self.frequency.items():
+            weight = math.log((1 + total) / (1 + count)) + 1
+            if feature[0] == 't':
+                weight *= TAG_WEIGHT
+            self.square[feature] = weight * weight
+        self.features = {}
+        self.postings = {}
+        self.norms = {}
+
+    def _rows(self, recipe_ids=None):
+        ingredients = RecipeIngredient.objects.order_by()
+        tags = Recipe.tags.through.objects.order_by()
+        if recipe_ids is not None:
+            ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+            tags = tags.filter(recipe_id__in=recipe_ids)
+        for kind, rows in (
+            ('i', ingredients.values_list('recipe_id', 'ingredient_id')),
+            ('t', tags.values_list('recipe_id', 'tag_id')),
+        ):
+            for recipe_id, value in rows.iterator():
+                if (kind, value) in self.square:
+                    yield recipe_id, (kind, value)
+
+    def _set_norms(self, recipe_ids):
+        square = self.square
+        for recipe_id in recipe_ids:
+            self.norms[recipe_id] = math.sqrt(
+                sum(map(square.__getitem__, self.features[recipe_id])))
+
+    def load_all(self):
+        """Загружает признаки всех рецептов для полного пересчета."""
+        self.features = {pk: set() for pk in
+                         Recipe.objects.values_list('pk', flat=True)
+                         .iterator()}
+        postings = defaultdict(set)
+        for recipe_id, feature in self._rows():
+            self.features[recipe_id].add(feature)
+            postings[feature].add(recipe_id)
+        self._set_norms(self.features)
+        self.postings = {
+            feature: heapq.nlargest(self.cap, recipe_ids)
+            for feature, recipe_ids in postings.items()
+        }
+
+    def load_features(self, recipe_ids):
+        """Дочитывает признаки существующих рецептов из recipe_ids."""
+        missing = set(recipe_ids) - self.features.keys()
+        for chunk in chunks(missing):
+            existing = list(Recipe.objects.filter(pk__in=chunk)
+                            .values_list('pk', flat=True))
+            self.features.update((pk, set()) for pk in existing)
+            for recipe_id, feature in self._rows(chunk):
+                self.features[recipe_id].add(feature)
+            self._set_norms(existing)
+
+    def load_postings(self, features):
+        """Дочитывает списки рецептов признаков, не больше cap на признак."""
+        missing = {feature for feature in features
+                   if feature not in self.postings}
+        rare = defaultdict(set)
+        for kind, model, field in (
+            ('i', RecipeIngredient, 'ingredient_id'),
+            ('t', Recipe.tags.through, 'tag_id'),
+        ):
+            for feature in missing:
+                if feature[0] == kind and self.frequency[feature] > self.cap:
+                    # частый признак: только самые новые рецепты
+                    self.postings[feature] = list(
+                        model.objects.filter(**{field: feature[1]})
+                        .order_by('-recipe_id')
+                        .values_list('recipe_id', flat=True)
+                        .distinct()[:self.cap])
+            ids = [feature[1] for feature in missing if feature[0] == kind
+                   and self.frequency[feature] <= self.cap]
+            for chunk in chunks(ids):
+                for value, recipe_id in (
+                    model.objects.filter(**{f'{field}__in': chunk})
+                    .order_by().values_list(field, 'recipe_id').iterator()
+                ):
+                    rare[kind, value].add(recipe_id)
+            for value in ids:
+                self.postings[kind, value] = list(rare[kind, value])
+
+    def candidates(self, recipe_id):
+        """Кандидаты в соседи из списков признаков, от редких к частым."""
+        found = set()
+        for feature in sorted(self.features.get(recipe_id, ()),
+                              key=self.frequency.__getitem__):
+            if len(found) >= ENOUGH_CANDIDATES:
+                break
+            found.update(self.postings[feature])
+        found.discard(recipe_id)
+        return found
+
+    def prepare(self, recipe_ids):
+        """Одним проходом загружает все для расчета соседей recipe_ids."""
+        self.load_features(recipe_ids)
+        self.load_postings({feature for recipe_id in recipe_ids
+                            for feature in self.features.get(recipe_id, ())})
+        self.load_features({candidate for recipe_id in recipe_ids
+                            for candidate in self.candidates(recipe_id)})
+
+    def similarities(self, recipe_id):
+        """Сходство рецепта со всеми кандидатами: [(score, recipe_id)].
+
+        Признаки и списки должны быть загружены prepare.
+        """
+        features = self.features.get(recipe_id)
+        if not features:
+            return []
+        square, norms = self.square.__getitem__, self.norms
+        norm = norms[recipe_id]
+        scores = []
+        for candidate in self.candidates(recipe_id):
+            # кандидат мог быть удален после чтения списков
+            other = self.features.get(candidate)
+            if other:
+                scores.append((
+                    sum(map(square, features & other))
+                    / (norm * norms[candidate]),
+                    candidate))
+        return scores
+
+
+def neighbours(recipe_id, store, k=TOP_K):
+    """k самых похожих рецептов: [(score, recipe_id)]."""
+    return heapq.nlargest(k, store.similarities(recipe_id))
+
+
+def affected_recipes(changed_ids, store, k):
+    """Измененные рецепты и рецепты, чьи списки соседей из-за них
+    могли поменяться.
+
+    Списки несимметричны, поэтому, кроме самих changed_ids,
+    пересчитываются рецепты, в чьих сохраненных списках есть
+    измененный рецепт, и кандидаты, в список которых измененный
+    рецепт теперь попадает: сходство с ним выше худшего сохраненного
+    или список короче k.
+    """
+    store.prepare(changed_ids)
+    changed = set(changed_ids) & store.features.keys()
+    affected = set(changed)
+    for chunk in chunks(changed_ids):
+        affected.update(
+            SimilarRecipe.objects.filter(similar_id__in=chunk)
+            .values_list('recipe_id', flat=True))
+    best = {}
+    for recipe_id in changed:
+        for score, candidate in store.similarities(recipe_id):
+            best[candidate] = max(best.get(candidate, 0), score)
+    best = {pk: score for pk, score in best.items() if pk not in affected}
+    stored = {}
+    for chunk in chunks(best):
+        stored.update(
+            (recipe_id, (count, worst)) for recipe_id, count, worst in
+            SimilarRecipe.objects.filter(recipe_id__in=chunk)
+            .order_by().values('recipe_id')
+            .annotate(count=Count('id'), worst=Min('score'))
+            .values_list('recipe_id', 'count', 'worst'))
+    for recipe_id, score in best.items():
+        count, worst = stored.get(recipe_id, (0, 0))
+        if count < k or score > worst:
+            affected.add(recipe_id)
+    return affected
+
+
+def rebuild_similar(k=TOP_K, changed_ids=None, batch_size=CHUNK_SIZE):
+    """Пересчитывает списки соседей, возвращает число рецептов.
+
+    Без changed_ids пересчитываются все рецепты, иначе только
+    затронутые изменениями рецептов changed_ids.
+    """
+    store = FeatureStore()
+    if changed_ids is None:
+        store.load_all()
+        recipe_ids = list(store.features)
+        SimilarRecipe.objects.all().delete()
+    else:
+        recipe_ids = sorted(affected_recipes(set(changed_ids), store, k))
+        for chunk in chunks(recipe_ids, batch_size):
+            SimilarRecipe.objects.filter(recipe_id__in=chunk).delete()
+    for chunk in chunks(recipe_ids, batch_size):
+        store.prepare(chunk)
+        SimilarRecipe.objects.bulk_create(
+            SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                          score=score)
+            for recipe_id in chunk
+            for score, similar_id in neighbours(recipe_id, store, k)
+        )
+    return len(recipe_ids)
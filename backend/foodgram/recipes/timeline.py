@@ -0,0 +1,133 @@
+"""Лента рецептов авторов, на которых подписан пользователь.
+
+Новый рецепт раскладывается по лентам подписчиков автора
+(TimelineEntry) при публикации. Авторы, у которых подписчиков больше
+TIMELINE_FANOUT_MAX_FOLLOWERS, не раскладываются: их рецепты
+подмешиваются при чтении. Лента читается keyset-пагинацией по
+(pub_date, recipe_id).
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import OuterRef, Q, Subquery
+
+from users.models import Subscribe, User
+
+from .models import Recipe, TimelineEntry
+
+BACKFILL_PER_AUTHOR = 100
+BATCH_SIZE = 1000
+
+
+def fanout_authors(author_ids):
+    """Авторы из author_ids, чьи рецепты раскладываются по лентам."""
+    return set(
+        User.objects.filter(
+            pk__in=author_ids,
+            followers_count__lt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS)
+        .values_list('pk', flat=True))
+
+
+def insert_entries(user_ids, recipes, batch_size=BATCH_SIZE):
+    """Добавляет recipes [(id, author_id, pub_date)] в ленты user_ids."""
+    entries = (
+        TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id, pub_date=pub_date)
+        for user_id in user_ids
+        for recipe_id, author_id, pub_date in recipes
+    )
+    while True:
+        batch = list(islice(entries, batch_size))
+        if not batch:
+            return
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(recipe):
+    """Раскладывает новый рецепт по лентам подписчиков автора."""
+    if not fanout_authors([recipe.author_id]):
+        return
+    followers = Subscribe.objects.filter(
+        author_id=recipe.author_id).values_list('user_id', flat=True)
+    insert_entries(followers.iterator(),
+                   [(recipe.pk, recipe.author_id, recipe.pub_date)])
+
+
+def recent_recipes(author_ids, per_author=BACKFILL_PER_AUTHOR):
+    """Последние per_author рецептов каждого автора одним запросом."""
+    return list(
+        Recipe.objects.filter(author_id__in=author_ids).filter(
+            pk__in=Subquery(
+                Recipe.objects.filter(author=OuterRef('author'))
+                .order_by('-pub_date', '-id')
+                .values('pk')[:per_author]
+            )
+        ).values_list('pk', 'author_id', 'pub_date')
+    )
+
+
+def follow(user, author_ids):
+    """Добавляет в ленту недавние рецепты новых подписок."""
+    author_ids = fanout_authors(author_ids)
+    if author_ids:
+        insert_entries([user.pk], recent_recipes(author_ids))
+
+
+def unfollow(user, author_ids):
+    TimelineEntry.objects.filter(user=user,
+                                 author_id__in=author_ids).delete()
+
+
+def backfill(user_ids=None, per_author=BACKFILL_PER_AUTHOR,
+             batch_size=BATCH_SIZE):
+    """Заполняет ленты по текущим подпискам, возвращает число авторов."""
+    subscriptions = Subscribe.objects.all()
+    if user_ids is not None:
+        subscriptions = subscriptions.filter(user_id__in=user_ids)
+    author_ids = fanout_authors(
+        subscriptions.values('author_id').distinct())
+    for author_id in author_ids:
+        recipes = recent_recipes([author_id], per_author)
+        if not recipes:
+            continue
+        followers = subscriptions.filter(
+            author_id=author_id).values_list('user_id', flat=True)
+        insert_entries(followers.iterator(), recipes, batch_size)
+    return len(author_ids)
+
+
+def before(position, date_field, id_field):
+    """Условие keyset-пагинации: строго раньше позиции (pub_date, id)."""
+    if position is None:
+        return Q()
+    pub_date, pk = position
+    return (Q(**{f'{date_field}__lt': pub_date})
+            | Q(**{date_field: pub_date, f'{id_field}__lt': pk}))
+
+
+def timeline(user, limit, position=None):
+    """Страница ленты: [(pub_date, recipe_id)] от новых к старым."""
+    stored = (
+        TimelineEntry.objects.filter(user=user)
+        .filter(before(position, 'pub_date', 'recipe_id'))
+        .order_by('-pub_date', '-recipe_id')
+        .values_list('pub_date', 'recipe_id')[:limit]
+    )
+    popular_authors = Subscribe.objects.filter(
+        user=user,
+        author__followers_count__gte=settings.TIMELINE_FANOUT_MAX_FOLLOWERS,
+    ).values('author_id')
+    merged = (
+        Recipe.objects.filter(author_id__in=Subquery(popular_authors))
+        .filter(before(position, 'pub_date', 'id'))
+        .order_by('-pub_date', '-id')
+        .values_list('pub_date', 'id')[:limit]
+    )
+    page = []
+    for item in heapq.merge(list(stored), list(merged), reverse=True):
+        if not page or page[-1] != item:
+            page.append(item)
+        if len(page) == limit:
+            break
+    return page
@@ -4,7 +4,9 @@ from .models import User, Subscribe
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
+    list_display = ('username', 'email', 'recipes_count', 'followers_count')
     list_filter = ('email', 'username')
+    readonly_fields = ('recipes_count', 'followers_count')
 
 
 admin.site.register(Subscribe)
@@ -1,9 +1,46 @@
-from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db import connections, models
+from django.db.models import Exists, OuterRef, Value, BooleanField
+from django.contrib.auth.models import AbstractUser, UserManager
 
 from .validators import validate_user
 
 
+class UserQuerySet(models.QuerySet):
+
+    def with_subscription(self, user):
+        """Аннотирует is_subscribed для текущего пользователя."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField()))
+        return self.annotate(
+            is_subscribed=Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('pk'))))
+
+    def lock(self):
+        """Блокирует строки по возрастанию pk, возвращает их id.
+
+        В SQLite блокировок строк нет: транзакция пустым UPDATE сразу
+        берет блокировку записи всей базы, как BEGIN IMMEDIATE, и
+        конкурирующие транзакции ждут ее timeout секунд. Ждать SQLite
+        может, только если транзакция до этого ничего не читала,
+        поэтому lock должен быть первым запросом в ней.
+        """
+        connection = connections[self.db]
+        if connection.vendor == 'sqlite':
+            quote = connection.ops.quote_name
+            table = quote(self.model._meta.db_table)
+            pk = quote(self.model._meta.pk.column)
+            with connection.cursor() as cursor:
+                cursor.execute(f'UPDATE {table} SET {pk} = {pk} WHERE 0')
+            return list(self.order_by('pk').values_list('pk', flat=True))
+        return list(self.select_for_update().order_by('pk')
+                    .values_list('pk', flat=True))
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     email = models.EmailField(max_length=254)
     username = models.CharField(max_length=150,
@@ -18,6 +55,12 @@ class User(AbstractUser):
                                  help_text='Введите фамилию')
     password = models.CharField(max_length=150,
                                 verbose_name='Пароль')
+    recipes_count = models.PositiveIntegerField(
+        default=0, verbose_name='Количество рецептов')
+    followers_count = models.PositiveIntegerField(
+        default=0, verbose_name='Количество подписчиков')
+
+    objects = CustomUserManager()
 
     def __str__(self):
         return self.username